@@ -0,0 +1,486 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import connection, models, transaction
+
+from . import cache, turns
+
+logger = logging.getLogger(__name__)
+
+# Live actors of this process by room id, and by table id for the readers
+_actors = {}
+_tables = {}
+_lock = threading.Lock()
+
+_STOP = object()
+
+
+class ActorStopped(Exception):
+    """ The actor stopped before running the command """
+
+
+class Conflict(Exception):
+    """ Another process wrote the room while the actor owned it """
+
+
+def enabled():
+    return getattr(settings, 'BATTLESHIP_ROOM_ACTORS', False)
+
+
+class TableState(object):
+    """ Board of a table kept by an actor and the cells changed since the
+    last flush. The version is incremented by every salvo that changes the
+    board, as in the database, and written by the flush
+    """
+
+    def __init__(self, table, board, boat_aux=None):
+        self.id = table.id
+        self.player = table.player_id
+        self.victim = table.victim
+        self.version = table.version
+        self.packed = table.packed is not None
+        self.board = board
+        self.boat_aux = boat_aux
+        self.changed = {}
+
+
+class RoomState(object):
+    """ State of a started room: boards, turns and counters. Only the thread
+    of its actor changes it
+    """
+
+    def __init__(self, room):
+        from .models import Boat, Player, Table
+        self.room_id = room.id
+        self.last_shot, self.winner = type(room).objects.values_list(
+                'last_shot', 'winner').get(id=room.id)
+        self.players = {p['id']: p for p in Player.objects.filter(
+            room_id=room.id).values('id', 'number_turn', 'on_game', 'turn',
+                'ships_left')}
+        self.own = {}
+        self.aux = {}
+        for table in Table.objects.filter(player__room_id=room.id):
+            self.load_table(table)
+        self.remaining = dict(Boat.objects.filter(
+            table__player__room_id=room.id, table__victim=0).values_list(
+                'id', 'remaining'))
+        self.shots = []
+        self.dirty_boats = set()
+        self.dirty_players = False
+
+    def load_table(self, table):
+        from .models import Boat
+        board = table._load_board()
+        boat_aux = None
+        if table.victim == 0:
+            state = self.own[table.player_id] = TableState(table, board)
+        else:
+            if table.packed is None:
+                boat_aux = Boat.objects.filter(table=table).values_list('id',
+                        flat=True).first()
+            state = TableState(table, board, boat_aux)
+            self.aux[(table.player_id, table.victim)] = state
+        return state
+
+    def get_aux(self, player, victim):
+        state = self.aux.get((player, victim))
+        if state is None:
+            from .models import Player
+            table = Player.objects.get(id=player).get_or_create_victim_table(
+                    victim)
+            state = self.load_table(table)
+            with _lock:
+                _tables[table.id] = _actors.get(self.room_id)
+        return state
+
+    def on_game(self):
+        return [p['id'] for p in sorted(self.players.values(),
+            key=lambda p: p['number_turn']) if p['on_game']]
+
+    def turn(self):
+        for p in self.players.values():
+            if p['turn']:
+                return p['id']
+        return None
+
+    def attack(self, positions, player, victim):
+        """ Same rules as Room.attack_salvo, applied to the state in
+        memory. Return a dict with the values of the shots, the sequence of
+        the first one, the sunk boats, if the victim was eliminated and the
+        winner
+        """
+        if self.winner:
+            raise ValueError('El juego termino')
+        if self.turn() != player:
+            raise turns.NotYourTurn('Aun no es tu turno')
+        own = self.own[victim]
+        aux = self.get_aux(player, victim)
+        n = own.board.size
+        if not all(0 <= r < n and 0 <= c < n for r, c in positions):
+            raise ValueError('Posicion fuera del mapa')
+        hits = [own.board.shoot(r, c) for r, c in positions]
+        values = ['T' if hit else 'X' for hit in hits]
+        first = self.last_shot + 1
+        self.last_shot += len(positions)
+        for i, ((r, c), v) in enumerate(zip(positions, values)):
+            if v == 'T':
+                own.changed[(r, c)] = v
+            aux.board.put(r, c, v)
+            aux.changed[(r, c)] = v
+            self.shots.append((first+i, player, victim, r, c, v))
+        if any(hits):
+            own.version += 1
+        aux.version += 1
+        sunk = []
+        boats = Counter(own.board.boat_at(r, c)
+                for (r, c), hit in zip(positions, hits) if hit)
+        for boat, k in boats.items():
+            if self.remaining.get(boat, 0) >= k:
+                self.remaining[boat] -= k
+                self.dirty_boats.add(boat)
+                if self.remaining[boat] == 0:
+                    sunk.append(boat)
+        eliminated = False
+        victim_state = self.players[victim]
+        if sunk and victim_state['ships_left'] > 0:
+            self.dirty_players = True
+            victim_state['ships_left'] = max(
+                    victim_state['ships_left'] - len(sunk), 0)
+            if victim_state['ships_left'] == 0:
+                eliminated = True
+                victim_state['on_game'] = victim_state['turn'] = False
+                alive = self.on_game()
+                if len(alive) == 1:
+                    self.winner = alive[0]
+        return {'values': values, 'first': first, 'sunk': sunk,
+                'eliminated': eliminated, 'winner': self.winner}
+
+    def end_shift(self, player=None):
+        """ Same rules as turns.rotate_turn """
+        order = [self.players[p] for p in self.on_game()]
+        current = [p for p in order if p['turn']]
+        if not current or (player is not None and
+                current[0]['id'] != player):
+            return None
+        current = current[0]
+        following = [p for p in order
+                if p['number_turn'] > current['number_turn']] or order
+        current['turn'] = False
+        following[0]['turn'] = True
+        self.dirty_players = True
+        return following[0]['id']
+
+    def pending(self):
+        return bool(self.shots or self.dirty_players or self.dirty_boats)
+
+
+class RoomActor(object):
+    """ Single writer of a started room. The commands of every request are
+    run one after another by the thread of the actor against the state in
+    memory, and the changes are written to the database in one transaction
+    every BATTLESHIP_ACTOR_FLUSH_MOVES commands or
+    BATTLESHIP_ACTOR_FLUSH_INTERVAL seconds. If the process dies the room is
+    loaded again from the last flush.
+    """
+
+    def __init__(self, room):
+        self.room_id = room.id
+        self.state = RoomState(room)
+        self.lock = threading.RLock()
+        self.queue = queue.Queue()
+        self.stopped = False
+        self.flush_moves = getattr(settings, 'BATTLESHIP_ACTOR_FLUSH_MOVES',
+                20)
+        self.interval = getattr(settings, 'BATTLESHIP_ACTOR_FLUSH_INTERVAL',
+                0.5)
+        self.idle = getattr(settings, 'BATTLESHIP_ACTOR_IDLE', 60)
+        self.thread = threading.Thread(target=self.run,
+                name='room-actor-%d' % room.id, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def call(self, name, *args):
+        """ Runs the command name of the state in the thread of the actor
+        and return its result
+        """
+        future = Future()
+        self.queue.put((name, args, future))
+        if self.stopped:
+            self._drain()
+        return future.result()
+
+    def read(self, func):
+        """ Return func(state) with the state locked """
+        with self.lock:
+            return func(self.state)
+
+    def run(self):
+        moves, last_command = 0, time.time()
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=self.interval)
+                except queue.Empty:
+                    self.flush()
+                    moves = 0
+                    if time.time() - last_command > self.idle:
+                        break
+                    continue
+                if item is _STOP:
+                    break
+                name, args, future = item
+                last_command = time.time()
+                if name == 'flush':
+                    # Asked by a reader of the database, see flush()
+                    try:
+                        self.flush()
+                    except Exception as e:
+                        future.set_exception(e)
+                        raise
+                    moves = 0
+                    future.set_result(None)
+                    continue
+                try:
+                    with self.lock:
+                        result = getattr(self.state, name)(*args)
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+                moves += 1
+                try:
+                    if moves >= self.flush_moves or self.state.winner:
+                        self.flush()
+                        moves = 0
+                except Exception as e:
+                    future.set_exception(e)
+                    raise
+                future.set_result(result)
+                if self.state.winner:
+                    break
+        except Conflict:
+            logger.error('Room %d was written by another process, the '
+                    'moves since the last flush were discarded', self.room_id)
+        except Exception:
+            logger.exception('Actor of room %d failed', self.room_id)
+        finally:
+            self._unregister()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Last flush of room %d failed',
+                        self.room_id)
+            self._drain()
+            connection.close()
+
+    def _unregister(self):
+        with _lock:
+            self.stopped = True
+            if _actors.get(self.room_id) is self:
+                del _actors[self.room_id]
+            for table_id in [t for t, a in _tables.items() if a is self]:
+                del _tables[table_id]
+
+    def _drain(self):
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP and not item[2].done():
+                item[2].set_exception(ActorStopped())
+
+    def stop(self):
+        """ Flushes the changes and stops the actor """
+        self.queue.put(_STOP)
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
+
+    def flush(self):
+        """ Writes the changes since the last flush in one transaction """
+        from .models import Boat, Cell, Player, Room, Shot, Table, \
+                cells_filter
+        with self.lock:
+            state = self.state
+            if not state.pending():
+                return
+            shots, state.shots = state.shots, []
+            tables = []
+            for t in list(state.own.values()) + list(state.aux.values()):
+                if t.changed:
+                    tables.append((t, t.version, t.changed, t.board.copy()))
+                    t.changed = {}
+            boats = {b: state.remaining[b] for b in state.dirty_boats}
+            state.dirty_boats = set()
+            players = [dict(p) for p in state.players.values()]
+            dirty_players, state.dirty_players = state.dirty_players, False
+            last_shot, winner = state.last_shot, state.winner
+        first = shots[0][0] - 1 if shots else last_shot
+        with transaction.atomic():
+            if not Room.objects.filter(id=self.room_id,
+                    last_shot=first).update(last_shot=last_shot,
+                            winner=winner):
+                transaction.set_rollback(True)
+                raise Conflict()
+            Shot.objects.bulk_create([Shot(room_id=self.room_id,
+                sequence=seq, shooter_id=shooter, victim_id=victim, row=r,
+                column=c, value=v)
+                for seq, shooter, victim, r, c, v in shots])
+            for t, version, changed, board in tables:
+                if t.packed:
+                    Table.objects.filter(id=t.id).update(version=version,
+                            packed=board.to_bytes(boats=t.victim == 0))
+                    continue
+                Table.objects.filter(id=t.id).update(version=version)
+                if t.victim == 0:
+                    Cell.objects.filter(cells_filter(changed),
+                            table_id=t.id).update(value='T',
+                                    version=version)
+                else:
+                    Cell.objects.filter(cells_filter(changed),
+                            table_id=t.id).delete()
+                    Cell.objects.bulk_create([Cell(table_id=t.id,
+                        boat_id=t.boat_aux, row=r, column=c, value=v,
+                        version=version) for (r, c), v in changed.items()])
+            if boats:
+                Boat.objects.filter(id__in=list(boats)).update(
+                        remaining=_case(boats))
+            if dirty_players:
+                Player.objects.filter(room_id=self.room_id).update(
+                        **_player_fields(players))
+        for t, version, changed, board in tables:
+            cache.board_changed(t, board, version)
+        if winner:
+            cache.room_changed(self.room_id)
+
+
+def _case(values, field=None):
+    """ Return a Case expression that gives values[id] to every id """
+    return models.Case(*[models.When(id=key, then=models.Value(value))
+        for key, value in values.items()],
+        output_field=field or models.IntegerField())
+
+
+def _player_fields(players):
+    """ Return the fields of the update of the players """
+    turns = {p['id']: p['turn'] for p in players}
+    boolean = models.BooleanField()
+    return {
+            'on_game': _case({p['id']: p['on_game'] for p in players},
+                boolean),
+            'turn': _case(turns, boolean),
+            'offensive': _case(turns, boolean),
+            'defense': _case(turns, boolean),
+            'ships_left': _case({p['id']: p['ships_left'] for p in players}),
+            }
+
+
+def get_actor(room):
+    """ Return the actor of the room, starting it if the room is being
+    played, or None if actors are disabled or the game is not running
+    """
+    if not enabled():
+        return None
+    with _lock:
+        actor = _actors.get(room.id)
+    if actor is not None:
+        return actor
+    if not room.start or room.winner:
+        return None
+    actor = RoomActor(room)
+    if actor.state.winner:
+        return None
+    with _lock:
+        if room.id in _actors:
+            return _actors[room.id]
+        _actors[room.id] = actor
+        for t in list(actor.state.own.values()) + \
+                list(actor.state.aux.values()):
+            _tables[t.id] = actor
+    actor.start()
+    return actor
+
+
+def call(room, name, *args):
+    """ Runs a command in the actor of the room, starting a new one if the
+    actor stopped meanwhile. Return None if there is no actor
+    """
+    for attempt in range(3):
+        actor = get_actor(room)
+        if actor is None:
+            return None
+        try:
+            return actor.call(name, *args)
+        except ActorStopped:
+            continue
+    raise ActorStopped()
+
+
+def read(room, func, default=None):
+    """ Return func(state) if the room has a live actor in this process or
+    default otherwise
+    """
+    if not _actors:
+        return default
+    with _lock:
+        actor = _actors.get(room.id)
+    return actor.read(func) if actor is not None else default
+
+
+def _read_table(table, func):
+    """ Return func(TableState) if a live actor owns the table or None """
+    if not _tables:
+        return None
+    with _lock:
+        actor = _tables.get(table.id)
+    if actor is None:
+        return None
+
+    def read_state(state):
+        for t in list(state.own.values()) + list(state.aux.values()):
+            if t.id == table.id:
+                return func(t)
+    return actor.read(read_state)
+
+
+def get_board(table):
+    """ Return a copy of the board of the table if a live actor owns it """
+    return _read_table(table, lambda t: t.board.copy())
+
+
+def get_version(table):
+    """ Return the version of the table if a live actor owns it """
+    return _read_table(table, lambda t: t.version)
+
+
+def flush(room):
+    """ Writes the moves kept by the live actor of the room, if it has one,
+    so the database is up to date. The actor is not started
+    """
+    with _lock:
+        actor = _actors.get(room.id)
+    if actor is None:
+        return
+    try:
+        actor.call('flush')
+    except ActorStopped:
+        # The actor writes everything before it stops
+        actor.thread.join()
+
+
+def stop(room_id=None):
+    """ Flushes and stops the actor of the room or every actor """
+    with _lock:
+        actors = [a for r, a in _actors.items()
+                if room_id is None or r == room_id]
+    for actor in actors:
+        actor.stop()
+
+
+atexit.register(stop)
@@ -1,6 +1,8 @@
 from django.contrib import admin
 from . import models
 
+admin.site.register(models.FleetSpec)
+admin.site.register(models.ShipType)
 admin.site.register(models.Room)
 admin.site.register(models.Player)
 admin.site.register(models.Table)
@@ -0,0 +1,264 @@
+import random
+import sys
+from array import array
+from collections import Counter
+from functools import lru_cache
+
+from django.contrib.auth.models import User
+
+from .board import Board
+
+BOT_USERNAME = 'battleship-bot'
+
+# Weight of a possible position of a boat for every hit that it covers
+HIT_WEIGHT = 20
+
+MISS = ord('X')
+HIT = ord('T')
+# Cells already chosen for the salvo, neither hits nor misses yet
+PENDING = '?'
+
+
+def _translation(values):
+    """ Return a table for bytes.translate that maps values to 1 and the
+    other bytes to 0
+    """
+    table = bytearray(256)
+    for v in values:
+        table[v] = 1
+    return bytes(table)
+
+
+MISSES = _translation([MISS])
+HITS = _translation([HIT])
+FREE = _translation([0])
+
+# Typecodes of the lanes of an integer where the scores of the cells are
+# added, the smallest one that can hold the scores of the fleet is used
+LANE_TYPES = ('H', 'I', 'Q')
+
+
+def get_bot_user():
+    """ Return the user shared by every computer player """
+    user, created = User.objects.get_or_create(username=BOT_USERNAME)
+    if created:
+        user.set_unusable_password()
+        user.save()
+    return user
+
+
+def add_bot(room, name='Computadora', rng=random):
+    """ Adds a computer player to the room with its fleet already placed
+    Params:
+        room -> Room instance
+        name -> Name of the player
+    Return the player or None if the fleet does not fit in the map
+    """
+    player = room.player_set.create(user=get_bot_user(), name=name,
+            is_bot=True)
+    table = player.table_set.create()
+    if not place_fleet(table, rng):
+        player.delete()
+        return None
+    player.set_ready(True)
+    return player
+
+
+def place_fleet(table, rng=random):
+    """ Puts the boats that are still available in the table in random legal
+    positions, chosen from the placement masks of the table. Return True if
+    the whole fleet was placed
+    """
+    placement = table.get_placement().copy()
+    boats = [name for name, amount in table.get_boat_quotas().items()
+            for i in range(amount)]
+    sizes = table.get_room_meta()['sizes']
+    fleet = []
+    # The biggest boats first, they are the hardest to fit
+    for name in sorted(boats, key=lambda b: -sizes[b]):
+        size = sizes[name]
+        anchors = [(r, c, o) for o in 'HV'
+                for r, c in placement.anchors(size, o)]
+        if not anchors:
+            return False
+        row, col, orientation = rng.choice(anchors)
+        placement.place(Board.footprint(row, col, size, orientation))
+        fleet.append(((row, col), orientation, name))
+    return table.set_fleet(fleet)
+
+
+@lru_cache(maxsize=None)
+def _starts(n, size):
+    """ Return one byte per cell of a n x n board, 1 where a horizontal boat
+    of size can start
+    """
+    return int.from_bytes((b'\x01' * (n-size+1) + b'\x00' * (size-1)) * n,
+            'little')
+
+
+@lru_cache(maxsize=None)
+def _ones(size, width):
+    """ Return size lanes of width bytes set to 1. Multiplying lanes by it
+    adds size consecutive lanes
+    """
+    return int.from_bytes((1).to_bytes(width, 'little') * size, 'little')
+
+
+def _lanes(data, width):
+    """ Return the bytes of data, one per cell, as one integer with a lane
+    of width bytes per cell
+    """
+    buf = bytearray(len(data) * width)
+    buf[::width] = data
+    return int.from_bytes(buf, 'little')
+
+
+def _transpose(items, n):
+    """ Return the array of the n x n items transposed """
+    res = array(items.typecode, bytes(len(items) * items.itemsize))
+    for c in range(n):
+        res[c::n] = items[c*n:(c+1)*n]
+    return res
+
+
+def _to_array(lanes, typecode, length):
+    """ Return the lanes of the integer as an array of length items """
+    res = array(typecode)
+    res.frombytes(lanes.to_bytes(length * res.itemsize, 'little'))
+    if sys.byteorder == 'big':
+        res.byteswap()
+    return res
+
+
+def _lane_type(fleet):
+    """ Return the typecode of the smallest lanes that hold the highest
+    score that a cell can get
+    """
+    bound = sum(2 * size * amount * (1 + HIT_WEIGHT * size)
+            for size, amount in fleet.items())
+    for typecode in LANE_TYPES:
+        if bound < 1 << (8 * array(typecode).itemsize):
+            return typecode
+    raise ValueError('Demasiados barcos')
+
+
+def _row_scores(cells, n, fleet, width):
+    """ Return the score of the horizontal positions of the boats as one
+    integer with a lane per cell. The positions that can start in every
+    cell of the board are found at once with a mask of the misses, and the
+    lanes add the weight of every position to the cells that it covers
+    Params:
+        cells -> Bytes with the cells of the board row by row
+        fleet -> Dict size -> amount of remaining boats
+        width -> Bytes of every lane
+    """
+    misses = int.from_bytes(cells.translate(MISSES), 'little')
+    hits = cells.translate(HITS)
+    hits = _lanes(hits, width) if any(hits) else 0
+    full = (1 << (8*width)) - 1
+    total = 0
+    for size, amount in fleet.items():
+        if size > n:
+            continue
+        blocked = 0
+        for k in range(size):
+            blocked |= misses >> (8*k)
+        starts = _starts(n, size) & ~blocked
+        if not starts:
+            continue
+        starts = _lanes(starts.to_bytes(n*n, 'little'), width)
+        ones = _ones(size, width)
+        weight = starts * amount
+        if hits:
+            # Hits covered by the position that starts in every cell
+            covered = (hits * ones) >> (8*width*(size-1))
+            weight += (covered & starts * full) * (amount * HIT_WEIGHT)
+        total += weight * ones
+    return total
+
+
+def _scores(board, sizes):
+    """ Return the scores of density as an array """
+    n = board.size
+    fleet = Counter(sizes)
+    typecode = _lane_type(fleet)
+    width = array(typecode).itemsize
+    cells = bytes(board.cells)
+    columns = _transpose(array('B', cells), n).tobytes()
+    columns = _to_array(_row_scores(columns, n, fleet, width), typecode,
+            n*n)
+    total = _row_scores(cells, n, fleet, width) + int.from_bytes(
+            _transpose(columns, n).tobytes(), sys.byteorder)
+    total &= _lanes(cells.translate(FREE), width) * ((1 << (8*width)) - 1)
+    return _to_array(total, typecode, n*n)
+
+
+def density(board, sizes):
+    """ Return a list with a score for every cell of the board: the amount
+    of positions of the remaining boats that cover it, weighted by the hits
+    that each position covers. Positions over misses are impossible and the
+    cells already shot score 0.
+    Params:
+        board -> Board with the shots of the player, T is a hit and X a miss
+        sizes -> List with the size of the remaining boats
+    """
+    return _scores(board, sizes).tolist()
+
+
+def choose_shot(board, sizes, rng=random):
+    """ Return the (row, column) with the best score that was not shot yet
+    or None if every cell was shot
+    """
+    score = _scores(board, sizes)
+    best = max(score)
+    if not best:
+        cells = [i for i, v in enumerate(board.cells) if not v]
+        if not cells:
+            return None
+        return divmod(rng.choice(cells), board.size)
+    # The cells with the best score, searched in the bytes of the scores
+    data = score.tobytes()
+    pattern = array(score.typecode, [best]).tobytes()
+    width = len(pattern)
+    cells = []
+    i = data.find(pattern)
+    while i >= 0:
+        if i % width:
+            i = data.find(pattern, i + 1)
+            continue
+        cells.append(i // width)
+        i = data.find(pattern, i + width)
+    return divmod(rng.choice(cells), board.size)
+
+
+def choose_salvo(board, sizes, amount, rng=random):
+    """ Return a list with up to amount different (row, column) to shoot,
+    choosing every one as if the previous ones were still pending
+    """
+    board = board.copy()
+    shots = []
+    for i in range(amount):
+        pos = choose_shot(board, sizes, rng)
+        if pos is None:
+            break
+        board.put(pos[0], pos[1], PENDING)
+        shots.append(pos)
+    return shots
+
+
+def play_turn(room, player, rng=random):
+    """ Plays the turn of a computer player: chooses a victim and shoots
+    the best cells of its table (one or a salvo). The caller finishes the
+    turn. Return the shots or None if the player could not shoot
+    """
+    victims = [p for p in room.get_players_on_game() if p != player.id]
+    if not victims:
+        return None
+    victim = rng.choice(victims)
+    table = player.get_or_create_victim_table(victim)
+    shots = choose_salvo(table.get_board(), room.get_afloat_sizes(victim),
+            room.shots_per_turn, rng)
+    if not shots:
+        return None
+    room.attack_salvo(shots, player, victim)
+    return shots
@@ -0,0 +1,185 @@
+import json
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from . import actors, cache, identity, turns
+from .models import Player, Room, Table
+
+# Maximum amount of shots returned by a request
+SHOTS_LIMIT = 500
+
+
+def get_user_table(request, room, table):
+    """ Return the table of the room that belongs to the user """
+    t = get_object_or_404(Table.objects.select_related('player__room'),
+            id=table, player__room=room)
+    if t.player.user_id != request.user.id:
+        raise Http404
+    return t
+
+
+def board_data(table, board=None):
+    """ Return the compact representation of the table or of board """
+    board = board or table.get_board()
+    return {'table': table.id, 'size': table.get_map_size(),
+            'version': table.get_version(), 'encoding': 'rle',
+            'board': board.encode()}
+
+
+def int_param(request, name, default):
+    try:
+        return int(request.GET[name])
+    except (KeyError, ValueError):
+        return default
+
+
+@login_required
+def table_view(request, room, table):
+    """
+    Return the whole table run-length encoded with its version
+    """
+    return JsonResponse(board_data(get_user_table(request, room, table)))
+
+
+@login_required
+def table_changes(request, room, table):
+    """
+    Return the cells of the table that changed after the version given in
+    the since parameter. If the version is unknown the whole table is
+    returned
+    """
+    t = get_user_table(request, room, table)
+    since = int_param(request, 'since', -1)
+    version = t.get_version()
+    changes = t.get_changes(since) if 0 <= since <= version else None
+    if changes is None:
+        return JsonResponse(board_data(t))
+    return JsonResponse({'table': t.id, 'version': version,
+        'since': since, 'cells': changes})
+
+
+@login_required
+def table_placements(request, room, table):
+    """
+    Return the legal anchors of every boat that can still be placed in the
+    table, by orientation, as hexadecimal masks where the bit
+    row * size + column is the anchor (row, column)
+    """
+    t = get_user_table(request, room, table)
+    placement = t.get_placement()
+    sizes = t.get_room_meta()['sizes']
+    boats = {name: {o: '%x' % placement.mask(sizes[name], o)
+        for o in placement.ORIENTATIONS}
+        for name, amount in t.get_boat_quotas().items() if amount > 0}
+    return JsonResponse({'table': t.id, 'size': t.get_map_size(),
+        'version': t.version, 'boats': boats})
+
+
+@login_required
+def table_replay(request, room, table):
+    """
+    Return the table as it was after the shot number given in the at
+    parameter, by default after the last shot
+    """
+    t = get_user_table(request, room, table)
+    actors.flush(t.player.room)
+    last = Room.objects.values_list('last_shot', flat=True).get(
+            id=t.player.room_id)
+    at = min(max(int_param(request, 'at', last), 0), last)
+    data = board_data(t, t.get_board_at(at))
+    data['sequence'] = at
+    return JsonResponse(data)
+
+
+@login_required
+def room_shots(request, room):
+    """
+    Return in order the shots of the room after the sequence number given
+    in the since parameter, at most SHOTS_LIMIT of them. Only the players
+    of the room can read them
+    """
+    r = identity.get_or_404(Room, id=room)
+    if not Player.objects.filter(room=r, user=request.user).exists():
+        raise Http404
+    since = max(int_param(request, 'since', 0), 0)
+    limit = min(max(int_param(request, 'limit', SHOTS_LIMIT), 1),
+            SHOTS_LIMIT)
+    # The shots kept by the actor of the room are written first
+    actors.flush(r)
+    r.last_shot = Room.objects.values_list('last_shot', flat=True).get(
+            id=r.id)
+    return JsonResponse({'room': r.id, 'last': r.last_shot,
+        'since': since, 'shots': r.get_shots(since, limit)})
+
+
+@login_required
+@require_POST
+def room_attack(request, room):
+    """
+    Fires the shots of the turn of the user and finishes the turn. The body
+    is a json object with the victim id and the list of [row, column] of
+    the shots, at most shots_per_turn of the room
+    """
+    r = identity.get_or_404(Room, id=room)
+    p = r.get_player_from_user(request.user)
+    if p is None:
+        raise Http404
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+        victim = int(data['victim'])
+        shots = [(int(row), int(col)) for row, col in data['shots']]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Datos invalidos'}, status=400)
+    if r.winner or not r.is_turn_of(p):
+        return JsonResponse({'error': 'Aun no es tu turno'}, status=409)
+    if not 0 < len(shots) <= r.shots_per_turn:
+        return JsonResponse({'error': 'Cantidad de disparos invalida'},
+                status=400)
+    if len(set(shots)) != len(shots):
+        return JsonResponse({'error': 'Posicion repetida'}, status=400)
+    if victim == p.id or victim not in r.get_players_on_game():
+        return JsonResponse({'error': 'Victima invalida'}, status=400)
+    p.get_or_create_victim_table(victim)
+    try:
+        values = r.attack_salvo(shots, p, victim)
+    except turns.NotYourTurn as e:
+        return JsonResponse({'error': str(e)}, status=409)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    turn = None if r.winner else r.end_shift(p)
+    return JsonResponse({'values': values, 'last': r.last_shot,
+        'winner': r.winner, 'turn': turn})
+
+
+@staff_member_required
+def cache_stats(request):
+    """
+    Return the hits and misses of the battleship caches in this process
+    """
+    return JsonResponse(cache.stats())
+
+
+def health(request):
+    """ Answer of the worker to the checks of the router """
+    return JsonResponse({'status': 'ok'})
+
+
+@csrf_exempt
+@require_POST
+def release_room(request, room):
+    """
+    Flushes and drops the state of the room kept by this worker, called by
+    the router before the room moves to another worker
+    """
+    secret = getattr(settings, 'BATTLESHIP_ROUTER_SECRET', None)
+    if not secret or request.META.get('HTTP_X_BATTLESHIP_ROUTER') != secret:
+        raise Http404
+    actors.stop(int(room))
+    cache.room_changed(int(room))
+    return JsonResponse({'room': int(room), 'released': True})
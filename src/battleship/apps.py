@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class BattleshipConfig(AppConfig):
     name = 'battleship'
+
+    def ready(self):
+        from .db import setup_connection
+        connection_created.connect(setup_connection,
+                dispatch_uid='battleship-setup-connection')
@@ -0,0 +1,156 @@
+import asyncio
+import io
+import json
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import actors, events
+
+# Long poll of the events of a room, awaited in the event loop
+EVENTS_PATH = re.compile(r'^/room-(?P<room>[0-9]+)/events$')
+
+
+class ASGIHandler(object):
+    """ ASGI application that serves the Django WSGI application.
+
+    The views and the ORM are blocking, so every request runs in a thread
+    pool of BATTLESHIP_ASGI_THREADS threads and waits in the event loop
+    while the pool is busy. The long poll of the room events only takes a
+    thread to check the request and to render the events: the wait in
+    between is awaited on the broker, so the players waiting for their
+    turn do not hold any thread.
+    """
+
+    def __init__(self, wsgi_application, threads=None):
+        """
+        Params:
+            wsgi_application -> The Django WSGI application
+            threads -> Size of the pool, BATTLESHIP_ASGI_THREADS by default
+        """
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(threads or
+                getattr(settings, 'BATTLESHIP_ASGI_THREADS', 16))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError('Unsupported scope %s' % scope['type'])
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # The actors write their pending moves before exiting
+                await self.run(actors.stop)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        body = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body = b''.join(body)
+        match = EVENTS_PATH.match(scope['path'])
+        if match and scope['method'] == 'GET':
+            response = await self.room_events(scope, int(match.group('room')))
+        else:
+            response = await self.run(self.call_wsgi, environ(scope, body))
+        status, headers, content = response
+        await send({'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(k.lower().encode('latin1'), v.encode('latin1'))
+                for k, v in headers]})
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def room_events(self, scope, room):
+        """ Serves the long poll of the events of room. The view answers at
+        once and, if there is nothing new, the handler awaits the next
+        event and asks the view again
+        """
+        env = environ(scope, b'')
+        env['battleship.events_wait'] = False
+        response = await self.run(self.call_wsgi, env)
+        status, headers, content = response
+        if not status.startswith('200'):
+            return response
+        data = json.loads(content.decode())
+        if data['events']:
+            return response
+        broker = events.get_broker()
+        channel = events.room_channel(room)
+        timeout = getattr(settings, 'BATTLESHIP_EVENTS_TIMEOUT', 25)
+        if hasattr(broker, 'wait_async'):
+            await broker.wait_async(channel, data['last'], timeout)
+        else:
+            await self.run(broker.wait, channel, data['last'], timeout)
+        env = environ(scope, b'')
+        env['battleship.events_wait'] = False
+        return await self.run(self.call_wsgi, env)
+
+    def run(self, func, *args):
+        return asyncio.get_event_loop().run_in_executor(self.executor,
+                func, *args)
+
+    def call_wsgi(self, env):
+        """ Runs the WSGI application in the current thread. Return
+        (status, headers, content)
+        """
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'], response['headers'] = status, headers
+
+        result = self.wsgi_application(env, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            # Django closes the database connection of the thread here
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], content
+
+
+def environ(scope, body):
+    """ Return the WSGI environ of the ASGI http scope """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    env = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            env[name] = value
+            continue
+        key = 'HTTP_' + name
+        env[key] = env[key] + ',' + value if key in env else value
+    return env
@@ -0,0 +1,181 @@
+import sys
+from array import array
+
+# Typecode of the boat ids. They are stored in Table.packed as 4 byte little
+# endian integers, the same on every platform
+BOAT_TYPE = 'i'
+
+
+class Board(object):
+    """ Compact in-memory grid of a table.
+
+    Every cell is stored as one byte (0 is water, otherwise the ord of the
+    cell value) in a flat bytearray, and the id of the boat that owns the
+    cell is kept in a parallel array, so a N x N board costs O(N^2) bytes
+    instead of N^2 python objects.
+    """
+    WATER = 0
+
+    def __init__(self, size, occupied=()):
+        """
+        Params:
+            size -> Positive integer, the map size
+            occupied -> Iterable of values that mean a cell has a boat
+        """
+        self.size = size
+        self.occupied = frozenset(ord(v) for v in occupied)
+        self.cells = bytearray(size * size)
+        self.boats = array(BOAT_TYPE, [0]) * (size * size)
+
+    @classmethod
+    def from_cells(cls, size, cells, occupied=()):
+        """ Build a board from an iterable of (row, column, value, boat_id) """
+        board = cls(size, occupied)
+        for row, col, value, boat_id in cells:
+            board.put(row, col, value, boat_id)
+        return board
+
+    def index(self, row, col):
+        return row * self.size + col
+
+    def in_bounds(self, row, col):
+        return 0 <= row < self.size and 0 <= col < self.size
+
+    def put(self, row, col, value, boat_id=0):
+        """ Sets the value (and owner boat) of the cell (row, column) """
+        i = self.index(row, col)
+        self.cells[i] = ord(value[0]) if value else self.WATER
+        if boat_id:
+            self.boats[i] = boat_id
+
+    def get(self, row, col):
+        """ Return the value of the cell or WATER if it is empty """
+        v = self.cells[self.index(row, col)]
+        return chr(v) if v else self.WATER
+
+    def boat_at(self, row, col):
+        """ Return the id of the boat in (row, column) or None """
+        return self.boats[self.index(row, col)] or None
+
+    def is_occupied(self, row, col):
+        return self.cells[self.index(row, col)] in self.occupied
+
+    def area_is_free(self, row_from, row_to, col_from, col_to):
+        """ Check that no cell in the rectangle (bounds included and clipped
+        to the board) is occupied
+        """
+        row_from, col_from = max(row_from, 0), max(col_from, 0)
+        row_to = min(row_to, self.size - 1)
+        col_to = min(col_to, self.size - 1)
+        cells, occupied, size = self.cells, self.occupied, self.size
+        for r in range(row_from, row_to + 1):
+            start = r * size
+            for v in cells[start+col_from:start+col_to+1]:
+                if v in occupied:
+                    return False
+        return True
+
+    def fits(self, row, col, boat_size, orientation):
+        """ Check if a boat of boat_size fits with its anchor in
+        (row, column). The cells above and on the left of the boat must be
+        free too.
+        Params:
+            orientation -> 'H' Horizontal or 'V' Vertical
+        """
+        if not self.in_bounds(row, col):
+            return False
+        orientation = orientation.upper()
+        if orientation == 'H':
+            if col+boat_size-1 >= self.size:
+                return False
+            return self.area_is_free(row-1, row, col-1, col+boat_size-1)
+        if orientation == 'V':
+            if row+boat_size-1 >= self.size:
+                return False
+            return self.area_is_free(row-1, row+boat_size-1, col-1, col)
+        return False
+
+    @staticmethod
+    def footprint(row, col, boat_size, orientation):
+        """ Return the list of (row, column) covered by a boat """
+        if orientation.upper() == 'H':
+            return [(row, col+j) for j in range(boat_size)]
+        return [(row+i, col) for i in range(boat_size)]
+
+    def copy(self):
+        board = Board(self.size)
+        board.occupied = self.occupied
+        board.cells[:] = self.cells
+        board.boats = array(BOAT_TYPE, self.boats)
+        return board
+
+    def to_matrix(self, extended=False):
+        """ Return the board as a list of lists. If extended is True the
+        matrix has an extra row and column of water at the top and the left
+        """
+        offset = 1 if extended else 0
+        n = self.size + offset
+        water = self.WATER
+        table = [[water] * n for i in range(offset)]
+        for r in range(self.size):
+            start = r * self.size
+            row = [water] * offset
+            row.extend(chr(v) if v else water
+                       for v in self.cells[start:start+self.size])
+            table.append(row)
+        return table
+
+    def encode(self):
+        """ Return the board row by row as a run-length encoded list of
+        [value, length], where the value of the water is ''
+        """
+        runs = []
+        last, length = None, 0
+        for v in self.cells:
+            if v == last:
+                length += 1
+                continue
+            if length:
+                runs.append([chr(last) if last else '', length])
+            last, length = v, 1
+        if length:
+            runs.append([chr(last) if last else '', length])
+        return runs
+
+    def shoot(self, row, col):
+        """ Marks a hit in (row, column) if there is a boat. Return True if
+        it was a hit
+        """
+        if self.is_occupied(row, col):
+            self.put(row, col, 'T')
+            return True
+        return False
+
+    def to_bytes(self, boats=True):
+        """ Return the cells and, if boats is True, the boats of the board
+        packed as bytes
+        """
+        data = bytes(self.cells)
+        if boats:
+            ids = self.boats
+            if sys.byteorder == 'big':
+                ids = array(BOAT_TYPE, ids)
+                ids.byteswap()
+            data += ids.tobytes()
+        return data
+
+    @classmethod
+    def from_bytes(cls, size, data, occupied=()):
+        """ Build a board from the bytes returned by to_bytes """
+        board = cls(size, occupied)
+        n = size * size
+        board.cells[:] = data[:n]
+        if len(data) > n:
+            # Boards packed before the ids had a fixed width used 8 bytes
+            ids = array('q' if len(data) - n == 8 * n else BOAT_TYPE)
+            ids.frombytes(data[n:])
+            if sys.byteorder == 'big':
+                ids.byteswap()
+            board.boats = ids if ids.typecode == BOAT_TYPE else \
+                    array(BOAT_TYPE, ids)
+        return board
@@ -0,0 +1,129 @@
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from .board import Board
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    """ Return the cache set in BATTLESHIP_CACHE, 'default' if it's not set """
+    return caches[getattr(settings, 'BATTLESHIP_CACHE', 'default')]
+
+
+def _count(namespace, hit):
+    with _stats_lock:
+        _stats['%s_%s' % (namespace, 'hits' if hit else 'misses')] += 1
+
+
+def stats():
+    """ Return a dict with the hits and misses of every namespace in this
+    process
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def board_ttl():
+    """ Return the seconds that the values keyed by table version are kept.
+    Nothing invalidates them, the old versions expire
+    """
+    return getattr(settings, 'BATTLESHIP_BOARD_TTL', DEFAULT_TIMEOUT)
+
+
+def get_or_set(namespace, key, compute, timeout=DEFAULT_TIMEOUT):
+    """ Return the value cached as namespace:key or compute it and cache it
+    for timeout seconds, the default timeout of the backend if it's not
+    given. Hits and misses are counted by namespace
+    """
+    cache = get_cache()
+    full_key = 'battleship:%s:%s' % (namespace, key)
+    value = cache.get(full_key)
+    _count(namespace, value is not None)
+    if value is None:
+        value = compute()
+        cache.set(full_key, value, timeout)
+    return value
+
+
+def generation(namespace):
+    """ Return the current generation of the namespace. Cached values
+    keyed with the generation are invalidated by bumping it
+    """
+    cache = get_cache()
+    key = 'battleship:generation:%s' % namespace
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, 1, None)
+        value = cache.get(key, 1)
+    return value
+
+
+def bump(namespace):
+    """ Invalidates every value cached in the namespace """
+    cache = get_cache()
+    key = 'battleship:generation:%s' % namespace
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+
+def room_meta(room_id, load):
+    """ Return the cached metadata of the room (map size, boat sizes and
+    ships), calling load to build it on a miss
+    """
+    return get_or_set('room', room_id, load)
+
+
+def room_changed(room_id):
+    """ Invalidates the metadata of the room and the lobby """
+    get_cache().delete('battleship:room:%s' % room_id)
+    bump('lobby')
+
+
+def _board_key(table, version=None):
+    if version is None:
+        version = table.get_version()
+    return '%d:%d' % (table.id, version)
+
+
+def get_board(table, load):
+    """ Return the Board of the table at its version, calling load to build
+    it on a miss. New versions get new keys, so boards never go stale
+    """
+    def compute():
+        board = load()
+        return (board.size, board.to_bytes())
+    size, data = get_or_set('board', _board_key(table), compute,
+            board_ttl())
+    return Board.from_bytes(size, data, table.get_ocupado())
+
+
+def board_changed(table, board, version=None):
+    """ Stores the board of the table at its new version, by default the
+    current one of the table
+    """
+    get_cache().set('battleship:board:%s' % _board_key(table, version),
+            (board.size, board.to_bytes()), board_ttl())
+
+
+def board_html(table, render):
+    """ Return the html of the board of the table at its version """
+    return get_or_set('board-html', _board_key(table), render, board_ttl())
+
+
+def placement(table, build):
+    """ Return the placement masks of the table at its version """
+    return get_or_set('placement', _board_key(table), build, board_ttl())
+
+
+def placement_changed(table, masks):
+    """ Stores the placement masks of the table at its new version """
+    get_cache().set('battleship:placement:%s' % _board_key(table), masks,
+            board_ttl())
@@ -0,0 +1,23 @@
+from django.conf import settings
+
+# Pragmas of the SQLite connections, BATTLESHIP_SQLITE_PRAGMAS overrides them.
+# The wait for a locked database is the timeout option of DATABASES.
+SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -20000,
+        'temp_store': 'MEMORY',
+        }
+
+
+def setup_connection(sender, connection, **kwargs):
+    """ Tunes every new SQLite connection, WAL lets the readers work while a
+    game is being written
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'BATTLESHIP_SQLITE_PRAGMAS', SQLITE_PRAGMAS)
+    cursor = connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute('PRAGMA %s = %s' % (name, value))
+    cursor.close()
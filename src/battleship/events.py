@@ -0,0 +1,123 @@
+import asyncio
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+class Broker(object):
+    """ In-process stand-in of a pub/sub broker like Redis. Every channel
+    keeps its last events numbered with an increasing sequence, so a
+    subscriber asks for the events after the last one it has seen and waits
+    until there is something new.
+    """
+
+    def __init__(self, history=200):
+        self.history = history
+        self._channels = {}
+        self._sequences = {}
+        self._changed = threading.Condition()
+        self._waiters = {}
+
+    def publish(self, channel, event):
+        """ Appends event to the channel and wakes up the subscribers.
+        Return the sequence number of the event
+        """
+        with self._changed:
+            seq = self._sequences.get(channel, 0) + 1
+            self._sequences[channel] = seq
+            events = self._channels.setdefault(channel,
+                    deque(maxlen=self.history))
+            events.append((seq, event))
+            self._changed.notify_all()
+            waiters = list(self._waiters.get(channel, ()))
+        for wake in waiters:
+            wake()
+        return seq
+
+    def last(self, channel):
+        """ Return the sequence number of the last event of the channel """
+        return self._sequences.get(channel, 0)
+
+    def since(self, channel, seq):
+        """ Return a list of (seq, event) published after seq. If some of
+        them were already discarded a 'resync' event is returned first
+        """
+        events = self._channels.get(channel, ())
+        res = [(s, e) for s, e in events if s > seq]
+        if events and events[0][0] > seq + 1 or \
+                seq > self.last(channel):
+            res.insert(0, (self.last(channel), {'type': 'resync'}))
+        return res
+
+    def wait(self, channel, seq, timeout=None):
+        """ Like since but blocks until there are new events or timeout
+        seconds have passed
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.last(channel) != seq,
+                    timeout)
+            return self.since(channel, seq)
+
+    async def wait_async(self, channel, seq, timeout=None):
+        """ Like wait but awaits in the event loop, so the subscriber does
+        not hold a thread while it waits
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(
+                    lambda: future.done() or future.set_result(None))
+
+        with self._changed:
+            if self.last(channel) != seq:
+                return self.since(channel, seq)
+            self._waiters.setdefault(channel, set()).add(wake)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._changed:
+                waiters = self._waiters.get(channel)
+                waiters.discard(wake)
+                if not waiters:
+                    del self._waiters[channel]
+        with self._changed:
+            return self.since(channel, seq)
+
+
+_broker = None
+
+
+def get_broker():
+    """ Return the broker set in BATTLESHIP_BROKER """
+    global _broker
+    if _broker is None:
+        path = getattr(settings, 'BATTLESHIP_BROKER',
+                'battleship.events.Broker')
+        _broker = import_string(path)()
+    return _broker
+
+
+def room_channel(room_id):
+    return 'room-%d' % room_id
+
+
+def publish(room_id, event_type, **data):
+    """ Publish an event of the room once the current transaction commits
+    Params:
+        room_id -> Id of the room
+        event_type -> String turn, shot, ready or start
+    """
+    data['type'] = event_type
+    channel = room_channel(room_id)
+    transaction.on_commit(lambda: get_broker().publish(channel, data))
+
+
+def last_event(room_id):
+    """ Return the sequence number of the last event of the room """
+    return get_broker().last(room_channel(room_id))
@@ -0,0 +1,66 @@
+from functools import lru_cache
+
+# (name, letter, size) of the boats of the rooms without a FleetSpec, their
+# amounts are the fields of the room
+CLASSIC = (
+        ('portaaviones', 'P', 5),
+        ('acorazado', 'A', 4),
+        ('fragata', 'F', 3),
+        ('submarino', 'S', 3),
+        ('botepatrulla', 'B', 2),
+        )
+
+# Values of the cells that are not boats
+RESERVED_LETTERS = ('T', 'X')
+
+
+class Ruleset(object):
+    """ Data derived from the ships of a fleet, computed once per fleet.
+
+    Every table driven check (sizes, letters, quotas, footprints) reads it
+    instead of a code path per boat type.
+    """
+
+    def __init__(self, ships):
+        """
+        Params:
+            ships -> Tuple of (name, letter, size, amount)
+        """
+        self.ships = ships
+        self.sizes = {name: size for name, letter, size, amount in ships}
+        self.letters = {name: letter for name, letter, size, amount in ships}
+        self.amounts = {name: amount for name, letter, size, amount in ships}
+        self.occupied = [letter for name, letter, size, amount in ships]
+        self.boat_sizes = [size for name, letter, size, amount in ships
+                for i in range(amount)]
+        self.total_cells = sum(self.boat_sizes)
+        # Offsets of the cells of a boat from its anchor
+        self.footprints = {}
+        for size in set(self.sizes.values()):
+            self.footprints[(size, 'H')] = [(0, j) for j in range(size)]
+            self.footprints[(size, 'V')] = [(i, 0) for i in range(size)]
+
+    def footprint(self, row, col, name, orientation):
+        """ Return the list of (row, column) covered by a boat of type name
+        anchored in (row, column)
+        """
+        offsets = self.footprints[(self.sizes[name], orientation.upper())]
+        return [(row+i, col+j) for i, j in offsets]
+
+    def quotas(self, placed):
+        """ Return a dict with the amount of boats of each type that can
+        still be placed
+        Params:
+            placed -> Dict name -> amount of boats already placed
+        """
+        return {name: amount - placed.get(name, 0)
+                for name, amount in self.amounts.items()}
+
+
+@lru_cache(maxsize=None)
+def get_ruleset(ships):
+    """ Return the Ruleset of ships, shared by the whole process
+    Params:
+        ships -> Tuple of (name, letter, size, amount)
+    """
+    return Ruleset(tuple(ships))
@@ -4,7 +4,7 @@ from .models import Room, Player
 class CreateRoomForm(forms.ModelForm):
     class Meta:
         model = Room
-        fields = ['name', 'map_size',]
+        fields = ['name', 'map_size', 'shots_per_turn', 'fleet_spec']
 
 
 class CreatePlayerForm(forms.ModelForm):
@@ -15,6 +15,9 @@ class CreatePlayerForm(forms.ModelForm):
 
 class SetBoatsForm(forms.Form):
     ORIENTATION = (('H', 'Horizontal'), ('V', 'Vertical'))
+    BOATS = (('portaaviones', 'Porta avion'), ('acorazado', 'Acorazado'),
+            ('fragata', 'Fragata'), ('submarino', 'Submarino'),
+            ('botepatrulla', 'Bote patrulla'))
     row = forms.ChoiceField()
     column = forms.ChoiceField()
     orientation = forms.ChoiceField(choices=ORIENTATION)
@@ -22,25 +25,30 @@ class SetBoatsForm(forms.Form):
 
     def __init__(self, table, *args, **kwargs):
         super(SetBoatsForm, self).__init__(*args, **kwargs)
-        room = Room.objects.get(id=table.player.room.id)
-        n = room.get_map_size()
-        BOATS = []
-        if table.add_aircraft_carrier_available():
-            BOATS.append(('portaaviones', 'Porta avion'))
-        if table.add_battleship_available():
-            BOATS.append(('acorazado', 'Acorazado'))
-        if table.add_frigate_available():
-            BOATS.append(('fragata', 'Fragata'))
-        if table.add_submarine_available():
-            BOATS.append(('submarino', 'Submarino'))
-        if table.add_patrol_boat_available():
-            BOATS.append(('botepatrulla', 'Bote patrulla'))
-        BOATS = tuple(BOATS)
-        V = [(str(num-1), num) for num in range(1, n+1)]
-        self.fields['row'] = forms.ChoiceField(choices=V, label='fila')
-        self.fields['column'] = forms.ChoiceField(choices=V, label='columna')
+        self.table = table
+        quotas = table.get_boat_quotas()
+        labels = dict(self.BOATS)
+        BOATS = tuple((name, labels.get(name, name.capitalize()))
+                for name, amount in quotas.items() if amount > 0)
+        # Only the rows and columns where some boat can still be anchored
+        sizes = table.get_room_meta()['sizes']
+        rows, columns = table.get_placement().rows_and_columns(
+                [sizes[boat_type] for boat_type, name in BOATS])
+        ROWS = [(str(num), num+1) for num in rows]
+        COLUMNS = [(str(num), num+1) for num in columns]
+        self.fields['row'] = forms.ChoiceField(choices=ROWS, label='fila')
+        self.fields['column'] = forms.ChoiceField(choices=COLUMNS,
+                label='columna')
         self.fields['boat_type'] = forms.ChoiceField(choices=BOATS)
 
+    def clean(self):
+        data = super(SetBoatsForm, self).clean()
+        if not self.errors and not self.table.position_is_valid(
+                (int(data['row']), int(data['column'])),
+                data['orientation'], data['boat_type']):
+            raise forms.ValidationError('No se puede ubicar en esta posición')
+        return data
+
 class SelectVictimForm(forms.Form):
     victim = forms.ChoiceField()
 
@@ -51,6 +59,9 @@ class SelectVictimForm(forms.Form):
 
 
 class AttackForm(forms.Form):
+    """ One row and column for every shot of the turn of the room: row and
+    column, then row_2 and column_2 and so on in salvo mode
+    """
     row = forms.ChoiceField()
     column = forms.ChoiceField()
 
@@ -58,6 +69,25 @@ class AttackForm(forms.Form):
         super(AttackForm, self).__init__(*args, **kwargs)
         n = room.get_map_size()
         VALUES = [(str(num-1), num) for num in range(1, n+1)]
-        self.fields['row'] = forms.ChoiceField(choices=VALUES, label='fila')
-        self.fields['column'] = forms.ChoiceField(choices=VALUES,
-                label='columna')
+        self.shots = max(room.shots_per_turn, 1)
+        for i in range(1, self.shots+1):
+            suffix = '_%d' % i if i > 1 else ''
+            self.fields['row' + suffix] = forms.ChoiceField(choices=VALUES,
+                    label='fila')
+            self.fields['column' + suffix] = forms.ChoiceField(
+                    choices=VALUES, label='columna')
+
+    def clean(self):
+        data = super(AttackForm, self).clean()
+        if not self.errors:
+            positions = self.get_positions()
+            if len(set(positions)) != len(positions):
+                raise forms.ValidationError(
+                        'No se puede disparar dos veces a la misma posición')
+        return data
+
+    def get_positions(self):
+        """ Return the list of (row, column) of the shots """
+        data = self.cleaned_data
+        return [(int(data['row' + s]), int(data['column' + s]))
+                for s in [''] + ['_%d' % i for i in range(2, self.shots+1)]]
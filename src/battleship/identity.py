@@ -0,0 +1,134 @@
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection, models
+from django.http import Http404
+from django.test.utils import CaptureQueriesContext
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# Relations loaded together with each model
+RELATED = {
+        'Table': ('player__room',),
+        'Player': ('room',),
+        }
+
+
+def _key(model, lookup):
+    items = []
+    for name, value in sorted(lookup.items()):
+        if isinstance(value, models.Model):
+            name, value = name + '_id', value.pk
+        if name == 'pk':
+            name = 'id'
+        if isinstance(value, str) and value.isdigit():
+            value = int(value)
+        items.append((name, value))
+    return (model, tuple(items))
+
+
+def _objects():
+    return getattr(_local, 'objects', None)
+
+
+def _register(objects, instance):
+    """ Adds instance and its related objects to the map. The related
+    objects that were already in the map replace the loaded ones
+    """
+    instance = objects.setdefault(_key(type(instance), {'id': instance.pk}),
+            instance)
+    for related in RELATED.get(type(instance).__name__, ()):
+        obj = instance
+        for name in related.split('__'):
+            parent, obj = obj, getattr(obj, name)
+            obj = objects.setdefault(_key(type(obj), {'id': obj.pk}), obj)
+            setattr(parent, name, obj)
+    return instance
+
+
+def get(model, **lookup):
+    """ Return the instance of model matching lookup. Inside a request the
+    instance is fetched once (with its related objects) and shared by every
+    caller
+    """
+    qs = model.objects.select_related(*RELATED.get(model.__name__, ()))
+    objects = _objects()
+    if objects is None:
+        return qs.get(**lookup)
+    key = _key(model, lookup)
+    if key not in objects:
+        objects[key] = _register(objects, qs.get(**lookup))
+    return objects[key]
+
+
+def get_or_404(model, **lookup):
+    try:
+        return get(model, **lookup)
+    except (model.DoesNotExist, ValueError):
+        raise Http404('No %s matches the given query.' % model.__name__)
+
+
+def forget(model):
+    """ Discards the instances of model, e.g. after a queryset update """
+    objects = _objects()
+    if objects:
+        for key in [k for k in objects if k[0] is model]:
+            del objects[key]
+
+
+class IdentityMapMiddleware(object):
+    """ Opens an identity map for every request """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _local.objects = {}
+        try:
+            return self.get_response(request)
+        finally:
+            _local.objects = None
+
+
+@contextmanager
+def budget_exempt():
+    """ The queries made inside the block do not count for the budget of the
+    view, e.g. the turns played by the computer after a human one
+    """
+    start = len(connection.queries_log)
+    try:
+        yield
+    finally:
+        if getattr(_local, 'exempt', None) is not None:
+            _local.exempt += len(connection.queries_log) - start
+
+
+def query_budget(budget):
+    """ Decorator that checks in DEBUG mode that a view does not make more
+    than budget queries. It fails if BATTLESHIP_QUERY_BUDGET_STRICT is True
+    or logs a warning otherwise
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not settings.DEBUG:
+                return view(request, *args, **kwargs)
+            _local.exempt = 0
+            with CaptureQueriesContext(connection) as queries:
+                response = view(request, *args, **kwargs)
+            n = len(queries) - _local.exempt
+            if n > budget:
+                msg = '%s made %d queries, the budget is %d' % (
+                        view.__name__, n, budget)
+                if getattr(settings, 'BATTLESHIP_QUERY_BUDGET_STRICT',
+                        False):
+                    raise AssertionError(msg)
+                logger.warning(msg)
+            return response
+        return wrapper
+    return decorator
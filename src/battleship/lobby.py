@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.db.models import Count
+
+from . import cache
+from .models import Room
+
+STATUS = ('open', 'started', 'finished')
+
+
+def get_rooms(status=None, map_size=None, before=None, limit=None):
+    """ Return a page of rooms as dicts with the amount of players, newest
+    first. The pages are cached for a few seconds and invalidated when a
+    room or a player changes
+    Params:
+        status -> None, 'open', 'started' or 'finished'
+        map_size -> Integer or None
+        before -> Id of the last room of the previous page or None
+        limit -> Size of the page
+    """
+    if limit is None:
+        limit = getattr(settings, 'BATTLESHIP_LOBBY_PAGE_SIZE', 20)
+    key = '%s:%s:%s:%s:%s' % (cache.generation('lobby'), status, map_size,
+            before, limit)
+
+    def compute():
+        qs = Room.objects.all()
+        if status == 'open':
+            qs = qs.filter(start=False)
+        elif status == 'started':
+            qs = qs.filter(start=True, winner=0)
+        elif status == 'finished':
+            qs = qs.exclude(winner=0)
+        if map_size is not None:
+            qs = qs.filter(map_size=map_size)
+        if before is not None:
+            qs = qs.filter(id__lt=before)
+        qs = qs.annotate(players=Count('player')).order_by('-id')
+        return list(qs.values('id', 'name', 'map_size', 'admin', 'start',
+            'winner', 'players')[:limit])
+
+    ttl = getattr(settings, 'BATTLESHIP_LOBBY_TTL', 10)
+    return cache.get_or_set('lobby', key, compute, ttl)
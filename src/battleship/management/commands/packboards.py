@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from battleship.models import Table, Cell
+
+
+class Command(BaseCommand):
+    help = 'Moves the boards stored as Cell rows to the packed column of ' \
+            'their tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-cells', action='store_true',
+                help='Do not delete the Cell rows of the packed tables')
+
+    def handle(self, *args, **options):
+        tables = Table.objects.filter(packed__isnull=True).select_related(
+                'player__room')
+        n = 0
+        for table in tables.iterator():
+            board = table._load_board()
+            with transaction.atomic():
+                if not table.save_packed(board):
+                    self.stderr.write('Table %d changed, skipped' % table.id)
+                    continue
+                if not options['keep_cells']:
+                    Cell.objects.filter(table=table).delete()
+            n += 1
+        self.stdout.write('%d tables packed' % n)
@@ -0,0 +1,58 @@
+import os
+import secrets
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from battleship import router
+
+
+class Command(BaseCommand):
+    help = 'Serves the rooms through a router that forwards every room to ' \
+            'the same worker process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--workers', type=int, default=0,
+                help='Amount of local workers to start')
+        parser.add_argument('--base-port', type=int, default=8001,
+                help='Port of the first local worker')
+        parser.add_argument('--worker', action='append', default=[],
+                help='Url of a worker already running, can be repeated')
+        parser.add_argument('--check-interval', type=float, default=2.0)
+
+    def handle(self, *args, **options):
+        workers = list(options['worker'])
+        secret = getattr(settings, 'BATTLESHIP_ROUTER_SECRET', None)
+        processes = []
+        if options['workers']:
+            secret = secret or secrets.token_hex(16)
+            env = dict(os.environ, BATTLESHIP_ROUTER_SECRET=secret,
+                    BATTLESHIP_ROOM_ACTORS='1')
+            for k in range(options['workers']):
+                port = options['base_port'] + k
+                processes.append(subprocess.Popen([sys.executable,
+                    sys.argv[0], 'runserver', '127.0.0.1:%d' % port,
+                    '--noreload'], env=env))
+                workers.append('http://127.0.0.1:%d' % port)
+        if not workers:
+            raise CommandError('Use --workers or --worker')
+        if not secret:
+            self.stderr.write('BATTLESHIP_ROUTER_SECRET is not set, rooms '
+                    'will move without being released')
+        self.stdout.write('Routing http://%s:%d to %s' % (options['host'],
+            options['port'], ', '.join(workers)))
+        try:
+            router.serve(router.Router(workers, secret or '',
+                check_interval=options['check_interval']),
+                options['host'], options['port'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait()
@@ -0,0 +1,165 @@
+import json
+import random
+import time
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+
+from battleship import actors, ai
+from battleship.models import FLEET_FIELDS, FleetSpec, Room, Player, Table
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values)-1, int(len(values) * p / 100))]
+
+
+class Command(BaseCommand):
+    help = 'Plays complete games through the model API and reports the ' \
+            'throughput, latency and queries of every operation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=10)
+        parser.add_argument('--map-size', type=int, default=10)
+        parser.add_argument('--players', type=int, default=2)
+        parser.add_argument('--fleet', default='',
+                help='Amount of each boat, e.g. portaaviones=1,fragata=2')
+        parser.add_argument('--fleet-spec',
+                help='Name of the FleetSpec of the rooms')
+        parser.add_argument('--shots-per-turn', type=int, default=1,
+                help='More than 1 plays in salvo mode')
+        parser.add_argument('--max-shots', type=int, default=0,
+                help='Shots per game, by default until there is a winner')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results as json')
+        parser.add_argument('--keep', action='store_true',
+                help='Do not delete the rooms after playing')
+
+    def handle(self, *args, **options):
+        for name in ('games', 'players'):
+            if options[name] < 1:
+                raise CommandError('--%s must be at least 1' % name)
+        self.rng = random.Random(options['seed'])
+        self.timings = defaultdict(list)
+        self.queries = defaultdict(list)
+        fleet = self.parse_fleet(options['fleet'])
+        if options['fleet_spec']:
+            try:
+                fleet['fleet_spec'] = FleetSpec.objects.get(
+                        name=options['fleet_spec'])
+            except FleetSpec.DoesNotExist:
+                raise CommandError('Unknown fleet spec: %s' %
+                        options['fleet_spec'])
+        users = [User.objects.get_or_create(username='sim-%d' % i)[0]
+                for i in range(options['players'])]
+        shots = 0
+        self.winners = 0
+        start = time.perf_counter()
+        for n in range(options['games']):
+            room = Room.objects.create(name='sim-%d' % n,
+                    map_size=options['map_size'],
+                    shots_per_turn=options['shots_per_turn'], **fleet)
+            shots += self.play(room, users, options['max_shots'])
+            actors.stop(room.id)
+            if not options['keep']:
+                room.delete()
+        elapsed = time.perf_counter() - start
+        result = {
+                'options': {k: options[k] for k in ('games', 'map_size',
+                    'players', 'fleet', 'fleet_spec', 'shots_per_turn',
+                    'max_shots', 'seed')},
+                'timestamp': time.time(),
+                'elapsed': elapsed,
+                'games_per_second': options['games'] / elapsed,
+                'shots_per_second': shots / elapsed,
+                'shots_per_game': shots / options['games'],
+                'finished_games': self.winners,
+                'operations': {name: {
+                    'count': len(times),
+                    'queries': sum(self.queries[name]) / len(times),
+                    'p50_ms': percentile(times, 50) * 1000,
+                    'p99_ms': percentile(times, 99) * 1000,
+                    } for name, times in sorted(self.timings.items())},
+                }
+        self.report(result)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(result, f, indent=2, sort_keys=True)
+
+    def parse_fleet(self, value):
+        fleet = {}
+        for item in filter(None, value.split(',')):
+            try:
+                name, amount = item.split('=')
+                fleet[FLEET_FIELDS[name.strip()]] = int(amount)
+            except (KeyError, ValueError):
+                raise CommandError('Invalid fleet: %s' % item)
+        return fleet
+
+    def measure(self, name, func, *args):
+        """ Calls func recording its latency and its queries as name """
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            res = func(*args)
+            self.timings[name].append(time.perf_counter() - start)
+        self.queries[name].append(len(queries))
+        return res
+
+    def play(self, room, users, max_shots):
+        """ Plays a game in room and return the amount of shots """
+        players = []
+        for user in users:
+            player = Player.objects.create(user=user, room=room,
+                    name=user.username)
+            table = Table.objects.create(player=player)
+            if not self.measure('set_fleet', ai.place_fleet, table,
+                    self.rng):
+                raise CommandError('The fleet does not fit in the map')
+            player.set_ready(True)
+            players.append(player)
+        self.measure('start_game', room.start_game)
+        n = room.map_size
+        pending = {(p.id, v.id): [(r, c) for r in range(n) for c in range(n)]
+                for p in players for v in players if p != v}
+        for cells in pending.values():
+            self.rng.shuffle(cells)
+        for p in players:
+            for v in players:
+                if p != v:
+                    p.get_or_create_victim_table(v.id)
+        shots = 0
+        while not max_shots or shots < max_shots:
+            player = room.get_turn_player()
+            alive = set(room.get_players_on_game())
+            victims = [v for (p, v), cells in pending.items()
+                    if p == player.id and v in alive and cells]
+            if not victims:
+                break
+            victim = self.rng.choice(victims)
+            cells = pending[(player.id, victim)]
+            positions = [cells.pop()
+                    for i in range(min(room.shots_per_turn, len(cells)))]
+            self.measure('attack', room.attack_salvo, positions, player,
+                    victim)
+            shots += len(positions)
+            if room.winner:
+                self.winners += 1
+                break
+            self.measure('end_shift', room.end_shift, player)
+        return shots
+
+    def report(self, result):
+        self.stdout.write('%.2f games/s, %.2f shots/s, %.1f shots/game, '
+                '%d games with a winner' % (result['games_per_second'],
+                    result['shots_per_second'], result['shots_per_game'],
+                    result['finished_games']))
+        for name, op in result['operations'].items():
+            self.stdout.write('%-12s %6d ops %6.1f queries  p50 %.2f ms  '
+                    'p99 %.2f ms' % (name, op['count'], op['queries'],
+                        op['p50_ms'], op['p99_ms']))
@@ -0,0 +1,181 @@
+import glob
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import Http404, HttpResponse
+from django.template.backends import django as django_backend
+
+from . import cache
+
+# Upper bounds of the latency histogram in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_views = {}
+_lock = threading.Lock()
+_local = threading.local()
+_last_dump = [0]
+
+
+def enabled():
+    return getattr(settings, 'BATTLESHIP_METRICS', False)
+
+
+def record(view, seconds, queries, sql_seconds, template_seconds):
+    """ Adds a request of view to the metrics of the process """
+    with _lock:
+        m = _views.setdefault(view, {'buckets': [0] * len(BUCKETS),
+            'count': 0, 'sum': 0.0, 'queries': 0, 'sql_seconds': 0.0,
+            'template_seconds': 0.0})
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                m['buckets'][i] += 1
+        m['count'] += 1
+        m['sum'] += seconds
+        m['queries'] += queries
+        m['sql_seconds'] += sql_seconds
+        m['template_seconds'] += template_seconds
+
+
+def snapshot():
+    """ Return the metrics of this process """
+    with _lock:
+        views = json.loads(json.dumps(_views))
+    return {'views': views, 'cache': cache.stats()}
+
+
+def dump(force=False):
+    """ Writes the snapshot of the process in BATTLESHIP_METRICS_DIR, at
+    most once every BATTLESHIP_METRICS_INTERVAL seconds
+    """
+    directory = getattr(settings, 'BATTLESHIP_METRICS_DIR', None)
+    interval = getattr(settings, 'BATTLESHIP_METRICS_INTERVAL', 5)
+    now = time.time()
+    if not directory or (not force and now - _last_dump[0] < interval):
+        return
+    _last_dump[0] = now
+    path = os.path.join(directory, 'metrics-%d.json' % os.getpid())
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(path + '.tmp', path)
+
+
+def _merge(total, data):
+    for view, m in data['views'].items():
+        t = total['views'].setdefault(view, {'buckets': [0] * len(BUCKETS),
+            'count': 0, 'sum': 0.0, 'queries': 0, 'sql_seconds': 0.0,
+            'template_seconds': 0.0})
+        t['buckets'] = [a + b for a, b in zip(t['buckets'], m['buckets'])]
+        for key in ('count', 'sum', 'queries', 'sql_seconds',
+                'template_seconds'):
+            t[key] += m[key]
+    for key, value in data['cache'].items():
+        total['cache'][key] = total['cache'].get(key, 0) + value
+
+
+def aggregate():
+    """ Return the metrics of every process that dumped them in
+    BATTLESHIP_METRICS_DIR, or only of this one if it is not set
+    """
+    directory = getattr(settings, 'BATTLESHIP_METRICS_DIR', None)
+    if not directory:
+        return snapshot()
+    dump(force=True)
+    total = {'views': {}, 'cache': {}}
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+        try:
+            with open(path) as f:
+                _merge(total, json.load(f))
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+def prometheus(data):
+    """ Return the metrics in the Prometheus text format """
+    lines = ['# TYPE battleship_request_seconds histogram']
+    for view, m in sorted(data['views'].items()):
+        for bound, n in zip(BUCKETS, m['buckets']):
+            lines.append('battleship_request_seconds_bucket{view="%s",'
+                    'le="%s"} %d' % (view, bound, n))
+        lines.append('battleship_request_seconds_bucket{view="%s",'
+                'le="+Inf"} %d' % (view, m['count']))
+        lines.append('battleship_request_seconds_sum{view="%s"} %f' % (
+            view, m['sum']))
+        lines.append('battleship_request_seconds_count{view="%s"} %d' % (
+            view, m['count']))
+    for name, key in (('sql_queries', 'queries'),
+            ('sql_seconds', 'sql_seconds'),
+            ('template_seconds', 'template_seconds')):
+        lines.append('# TYPE battleship_%s_total counter' % name)
+        for view, m in sorted(data['views'].items()):
+            lines.append('battleship_%s_total{view="%s"} %s' % (name, view,
+                m[key]))
+    lines.append('# TYPE battleship_cache_total counter')
+    for key, n in sorted(data['cache'].items()):
+        namespace, result = key.rsplit('_', 1)
+        lines.append('battleship_cache_total{namespace="%s",result="%s"} '
+                '%d' % (namespace, result, n))
+    return '\n'.join(lines) + '\n'
+
+
+def _timed_render(render):
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            if getattr(_local, 'template_seconds', None) is not None:
+                _local.template_seconds += time.perf_counter() - start
+    wrapper.timed = True
+    return wrapper
+
+
+class MetricsMiddleware(object):
+    """ Records the latency, the sql queries and the template render time
+    of every request by url name. It is only installed if
+    BATTLESHIP_METRICS is True
+    """
+
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        template = django_backend.Template
+        if not getattr(template.render, 'timed', False):
+            template.render = _timed_render(template.render)
+
+    def __call__(self, request):
+        _local.template_seconds = 0.0
+        debug_cursor = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        start_queries = len(connection.queries_log)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            connection.force_debug_cursor = debug_cursor
+        seconds = time.perf_counter() - start
+        queries = list(connection.queries_log)[start_queries:]
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else 'unknown'
+        record(view, seconds, len(queries),
+                sum(float(q['time']) for q in queries),
+                _local.template_seconds)
+        _local.template_seconds = None
+        dump()
+        return response
+
+
+def metrics_view(request):
+    """
+    Return the metrics of every worker in the Prometheus text format
+    """
+    if not enabled():
+        raise Http404
+    return HttpResponse(prometheus(aggregate()),
+            content_type='text/plain; version=0.0.4')
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:44
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Boat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Cell',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('column', models.IntegerField()),
+                ('row', models.IntegerField()),
+                ('value', models.CharField(default='', max_length=2)),
+                ('boat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='battleship.Boat')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Player',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20)),
+                ('on_game', models.BooleanField(default=False)),
+                ('number_turn', models.IntegerField(default=0)),
+                ('turn', models.BooleanField(default=False)),
+                ('ready', models.BooleanField(default=False)),
+                ('admin', models.BooleanField(default=False)),
+                ('offensive', models.BooleanField(default=False)),
+                ('defense', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Room',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30)),
+                ('map_size', models.IntegerField()),
+                ('aircraft_carrier', models.IntegerField(default=1)),
+                ('battleship', models.IntegerField(default=1)),
+                ('frigate', models.IntegerField(default=1)),
+                ('submarine', models.IntegerField(default=1)),
+                ('patrol_boat', models.IntegerField(default=1)),
+                ('start', models.BooleanField(default=False)),
+                ('winner', models.IntegerField(default=0)),
+                ('admin', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Table',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('victim', models.IntegerField(default=0)),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='battleship.Player')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='room',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='battleship.Room'),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='boat',
+            name='table',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='battleship.Table'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_cell_table(apps, schema_editor):
+    """ The cells of the baseline only reach their table through the boat """
+    Cell = apps.get_model('battleship', 'Cell')
+    Boat = apps.get_model('battleship', 'Boat')
+    boats = Boat.objects.filter(id=models.OuterRef('boat_id'))
+    Cell.objects.filter(table__isnull=True).update(
+            table=models.Subquery(boats.values('table_id')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('battleship', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cell',
+            name='table',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='battleship.Table'),
+        ),
+        migrations.RunPython(fill_cell_table, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='cell',
+            name='table',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='battleship.Table'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='cell',
+            unique_together=set([('table', 'row', 'column')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('battleship', '0003_board_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='is_bot',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:45
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('battleship', '0004_player_is_bot'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='table',
+            unique_together=set([('player', 'victim')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='boat',
+            index_together=set([('table', 'name')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='cell',
+            index_together=set([('boat', 'row', 'column'), ('table', 'version')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='player',
+            index_together=set([('room', 'number_turn'), ('user', 'room'), ('room', 'turn')]),
+        ),
+    ]
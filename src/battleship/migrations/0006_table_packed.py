@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('battleship', '0005_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='table',
+            name='packed',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
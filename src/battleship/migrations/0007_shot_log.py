@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('battleship', '0006_table_packed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoardSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.IntegerField()),
+                ('data', models.BinaryField()),
+                ('table', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='battleship.Table')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Shot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.IntegerField()),
+                ('row', models.IntegerField()),
+                ('column', models.IntegerField()),
+                ('value', models.CharField(max_length=2)),
+            ],
+            options={
+                'ordering': ['sequence'],
+            },
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='last_shot',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='shot',
+            name='room',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='battleship.Room'),
+        ),
+        migrations.AddField(
+            model_name='shot',
+            name='shooter',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shots_fired', to='battleship.Player'),
+        ),
+        migrations.AddField(
+            model_name='shot',
+            name='victim',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shots_received', to='battleship.Player'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='shot',
+            unique_together=set([('room', 'sequence')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='shot',
+            index_together=set([('victim', 'sequence'), ('shooter', 'victim', 'sequence')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='boardsnapshot',
+            unique_together=set([('table', 'sequence')]),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_counters(apps, schema_editor):
+    """ Counts the cells not hit yet of every boat and the boats afloat of
+    every player, so the games started before the counters go on
+    """
+    Boat = apps.get_model('battleship', 'Boat')
+    Player = apps.get_model('battleship', 'Player')
+    boats = Boat.objects.filter(table__victim=0).annotate(afloat=models.Sum(
+        models.Case(models.When(cell__value='T', then=0), default=1,
+            output_field=models.IntegerField())))
+    for boat in boats.iterator():
+        Boat.objects.filter(id=boat.id).update(remaining=boat.afloat or 0)
+    players = Boat.objects.filter(table__victim=0, remaining__gt=0).values(
+            'table__player_id').annotate(afloat=models.Count('id'))
+    for row in players.iterator():
+        Player.objects.filter(id=row['table__player_id']).update(
+                ships_left=row['afloat'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('battleship', '0007_shot_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='boat',
+            name='remaining',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='ships_left',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:45
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('battleship', '0009_room_shots_per_turn'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FleetSpec',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ShipType',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20)),
+                ('letter', models.CharField(max_length=1)),
+                ('size', models.IntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('amount', models.IntegerField(default=1, validators=[django.core.validators.MinValueValidator(0)])),
+                ('spec', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='battleship.FleetSpec')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='fleet_spec',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='battleship.FleetSpec'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='shiptype',
+            unique_together=set([('spec', 'letter'), ('spec', 'name')]),
+        ),
+    ]
@@ -1,17 +1,95 @@
-from django.db import models
+import logging
+from collections import Counter
+
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.urls import reverse
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator
+
+from . import actors, ai, cache, events, fleet, identity, turns
+from .board import Board
+from .placement import PlacementMasks
 
+logger = logging.getLogger(__name__)
 
-BOAT_SIZE = {
-        'portaaviones': 5,
-        'acorazado': 4,
-        'fragata':3,
-        'submarino':3,
-        'botepatrulla':2
+# Field of the room with the amount of each boat of the classic fleet
+FLEET_FIELDS = {
+        'portaaviones': 'aircraft_carrier',
+        'acorazado': 'battleship',
+        'fragata': 'frigate',
+        'submarino': 'submarine',
+        'botepatrulla': 'patrol_boat',
         }
 
-class Room(models.Model):
+def cells_filter(positions):
+    """ Return a Q object that matches the cells in positions, an iterable
+    of (row, column), or None if it is empty
+    """
+    q = None
+    for row, col in positions:
+        cell = models.Q(row=row, column=col)
+        q = cell if q is None else q | cell
+    return q
+
+
+class FieldUpdateMixin(object):
+    """ Saves only the fields changed by the setters """
+
+    def update_fields(self, **values):
+        """ Sets the values and saves only those fields """
+        for name, value in values.items():
+            setattr(self, name, value)
+        if self.pk is None:
+            self.save()
+        else:
+            self.save(update_fields=list(values))
+
+
+class FleetSpec(models.Model):
+    """ A set of ship types that a room can play with instead of the
+    classic fleet
+    """
+    name = models.CharField(max_length=30, unique=True)
+
+    def __str__(self):
+        return self.name
+
+    def get_ships(self):
+        """ Return a tuple of (name, letter, size, amount) of the ships """
+        return tuple(self.shiptype_set.order_by('id').values_list('name',
+            'letter', 'size', 'amount'))
+
+    def get_ruleset(self):
+        return fleet.get_ruleset(self.get_ships())
+
+
+class ShipType(models.Model):
+    spec = models.ForeignKey(FleetSpec)
+    name = models.CharField(max_length=20)
+    # Value of the cells of the ship in the boards
+    letter = models.CharField(max_length=1)
+    size = models.IntegerField(validators=[MinValueValidator(1)])
+    amount = models.IntegerField(default=1,
+            validators=[MinValueValidator(0)])
+
+    class Meta:
+        unique_together = [('spec', 'name'), ('spec', 'letter')]
+
+    def __str__(self):
+        return '%s (%d)' % (self.name, self.size)
+
+    def clean(self):
+        self.name = self.name.lower()
+        self.letter = self.letter.upper()
+        if self.letter in fleet.RESERVED_LETTERS:
+            raise ValidationError({'letter': 'Letra reservada'})
+
+
+class Room(FieldUpdateMixin, models.Model):
     name = models.CharField(max_length=30)
     map_size = models.IntegerField()
     aircraft_carrier = models.IntegerField(default=1)
@@ -22,6 +100,14 @@ class Room(models.Model):
     start = models.BooleanField(default=False)
     winner = models.IntegerField(default=0)
     admin = models.IntegerField(default=0)
+    # Sequence number of the last shot of the room
+    last_shot = models.IntegerField(default=0)
+    # Shots that a player fires in every turn, more than 1 is salvo mode
+    shots_per_turn = models.IntegerField(default=1,
+            validators=[MinValueValidator(1)])
+    # The classic fleet of the fields above is used if it is not set
+    fleet_spec = models.ForeignKey(FleetSpec, null=True, blank=True,
+            on_delete=models.PROTECT)
 
     def __str__(self):
         return self.name
@@ -33,6 +119,44 @@ class Room(models.Model):
         """ Return the map size of room """
         return self.map_size
 
+    def get_ships(self):
+        """ Return a tuple of (name, letter, size, amount) of the ships of
+        the room
+        """
+        if self.fleet_spec_id is not None:
+            return self.fleet_spec.get_ships()
+        return tuple((name, letter, size,
+            getattr(self, FLEET_FIELDS[name]))
+            for name, letter, size in fleet.CLASSIC)
+
+    def get_ruleset(self):
+        """ Return the Ruleset of the fleet of the room. The ships are read
+        from the cached metadata of the room
+        """
+        return fleet.get_ruleset(cache.room_meta(self.id,
+            self.get_meta)['ships'])
+
+    def get_meta(self):
+        """ Return a dict with the data of the room that the tables use """
+        ships = self.get_ships()
+        return {'map_size': self.map_size,
+                'sizes': dict(fleet.get_ruleset(ships).sizes), 'ships': ships}
+
+    def get_afloat_sizes(self, victim):
+        """ Return a list with the size of every boat of the victim that is
+        not sunk yet
+        Params:
+            victim -> Id of the victim player
+        """
+        sizes = self.get_ruleset().sizes
+        boats = Boat.objects.filter(table__player_id=victim, table__victim=0)
+        remaining = actors.read(self, lambda state: dict(state.remaining))
+        if remaining is None:
+            return [sizes[name] for name in boats.filter(
+                remaining__gt=0).values_list('name', flat=True)]
+        return [sizes[name] for boat, name in boats.values_list('id', 'name')
+                if remaining.get(boat)]
+
     def get_amount_aircraft_carrier(self):
         return self.aircraft_carrier
 
@@ -65,15 +189,14 @@ class Room(models.Model):
     def get_admin(self):
         """ Return the user admin """
         try:
-            user = User.objects.get(id=self.admin)
+            user = identity.get(User, id=self.admin)
             return user
         except User.DoesNotExist:
             return None
 
     def set_admin(self, user):
         """ Save the id of the user admin """
-        self.admin = user.id
-        self.save()
+        self.update_fields(admin=user.id)
 
     def get_start_game(self):
         """ Return True if the game is running """
@@ -84,24 +207,17 @@ class Room(models.Model):
         Params:
             value -> Should be True o False
         """
-        self.start = value
-        self.save()
+        self.update_fields(start=value)
 
     def start_game(self):
         """ Gives turn players and decide the first player """
         state, msg = self.check_state()
         if state:
-            self.set_start_game(True)
-            players = Player.objects.filter(room=self)
-            amount_players = len(players)
-            turns = [i for i in range(1, amount_players+1)]
-            for player in players:
-                player.set_number_turn(turns.pop(0))
-                player.set_on_game(True)
-            first_player = Player.objects.get(room=self, number_turn=1)
-            first_player.set_turn(True)
-            first_player.set_offensive(True)
-            first_player.set_defense(True)
+            first_player = turns.assign_turns(self)
+            if first_player is not None:
+                cache.room_changed(self.id)
+                events.publish(self.id, 'start', player=first_player)
+                self.play_bot_turns(first_player)
 
     def check_state(self):
         """ Verify that everything is correct for start the game """
@@ -125,8 +241,8 @@ class Room(models.Model):
             user -> User instance
         """
         try:
-            player = Player.objects.get(user=user, room=self)
-            table = Table.objects.get(player=player, victim=0)
+            player = identity.get(Player, user=user, room=self)
+            table = identity.get(Table, player=player, victim=0)
         except Player.DoesNotExist:
             return None
         return table
@@ -138,7 +254,7 @@ class Room(models.Model):
             user -> User instance
         """
         try:
-            player = Player.objects.get(user=user, room=self)
+            player = identity.get(Player, user=user, room=self)
             return player
         except Player.DoesNotExist:
             return None
@@ -147,48 +263,250 @@ class Room(models.Model):
         """ Return the number of players """
         return len(Player.objects.filter(room=self))
 
-    def end_shift(self):
-        """ A player's turn finishes """
-        player = Player.objects.get(room=self, turn=True)
-        n = self.get_len_players()
-        turn = (player.number_turn % n) + 1
-        next_player = Player.objects.get(room=self, turn=False,
-                number_turn=turn)
-        player.set_turn(False)
-        player.set_attack(False)
-        player.set_defense(False)
-
-        next_player.set_turn(True)
-        next_player.set_attack(True)
-        next_player.set_defense(True)
+    def end_shift(self, player=None):
+        """ A player's turn finishes. The players that were eliminated are
+        skipped and nothing changes once there is a winner
+        Params:
+            player -> Player instance. If it is given the turn only finishes
+                      if it's the turn of that player
+        """
+        next_player = self.rotate_turn(player)
+        if next_player is not None:
+            self.play_bot_turns(next_player)
+        return next_player
+
+    def rotate_turn(self, player=None):
+        """ Gives the turn to the next player on game, in the actor of the
+        room if it has one. Return the id of the next player or None
+        Params:
+            player -> Player instance. If it is given the turn only changes
+                      if it's the turn of that player
+        """
+        if self.winner:
+            return None
+        player_id = player.id if player is not None else None
+        if actors.get_actor(self) is not None:
+            next_player = actors.call(self, 'end_shift', player_id)
+        else:
+            next_player = turns.rotate_turn(self, player_id)
+        if next_player is not None:
+            events.publish(self.id, 'turn', player=next_player)
+        return next_player
+
+    def play_bot_turns(self, player_id):
+        """ Plays one turn after another while a computer player has the
+        turn, starting with player_id. When only computer players are left
+        they play the game until there is a winner
+        """
+        with identity.budget_exempt():
+            bots = set(Player.objects.filter(room=self,
+                is_bot=True).values_list('id', flat=True))
+            while player_id in bots and not self.winner:
+                player = Player.objects.get(id=player_id)
+                if ai.play_turn(self, player) is None:
+                    break
+                player_id = self.rotate_turn(player)
+
+    def get_players_on_game(self):
+        """ Return the ids of the players on game, by turn number """
+        on_game = actors.read(self, lambda state: state.on_game())
+        if on_game is None:
+            on_game = list(Player.objects.filter(room=self,
+                on_game=True).order_by('number_turn').values_list('id',
+                    flat=True))
+        return on_game
+
+    def get_turn_player(self):
+        """ Return the player who has the turn or None """
+        player_id = actors.read(self, lambda state: state.turn())
+        try:
+            if player_id is not None:
+                return identity.get(Player, id=player_id)
+            return Player.objects.get(room=self, turn=True)
+        except Player.DoesNotExist:
+            return None
+
+    def is_turn_of(self, player):
+        """ Check if it's the turn of player, a Player instance """
+        turn = actors.read(self, lambda state: state.turn())
+        return player.turn if turn is None else turn == player.id
+
+    def is_on_game(self, player):
+        """ Check if player, a Player instance, is still on game """
+        on_game = actors.read(self, lambda state: state.on_game())
+        return player.on_game if on_game is None else player.id in on_game
+
+    def next_shot(self, amount=1):
+        """ Reserves the next amount sequence numbers of shots of the room
+        and return the last one. The row of the room stays locked until the
+        end of the transaction, so the shots of a room are logged one after
+        another
+        """
+        Room.objects.filter(id=self.id).update(
+                last_shot=models.F('last_shot') + amount)
+        self.last_shot = Room.objects.values_list('last_shot',
+                flat=True).get(id=self.id)
+        return self.last_shot
+
+    def get_shots(self, since=0, limit=None):
+        """ Return a list with the shots of the room after the sequence
+        number since, in order
+        Params:
+            since -> Sequence number of the last shot already known
+            limit -> Maximum amount of shots returned
+        """
+        shots = Shot.objects.filter(room=self, sequence__gt=since).values(
+                'sequence', 'shooter', 'victim', 'row', 'column', 'value')
+        if limit is not None:
+            shots = shots[:limit]
+        return list(shots)
 
     def attack(self, pos, player, victim):
-        """ Attacks a victim specific
+        """ Attacks a victim specific. Return 'T' if it was a hit or 'X'
         Params:
             pos -> is a tuple (row, column)
             player -> Player instance. The player who attacks
             victim -> Id of victim player
         """
-        victim_player = Player.objects.get(id=victim)
-        table_victim = Table.objects.get(player=victim_player, victim=0)
-        table_player = Table.objects.get(player=player, victim=victim)
-        row, col = pos
-        tv = table_victim.get_table()
-        ocupado = table_victim.get_ocupado()
-
-        boat = Boat.objects.get(table=table_player)
-        if tv[row][col] in ocupado:
-            b = table_victim.get_boat_from_coord(row, col)
-            cv = Cell.objects.get(boat=b, row=row, column=col)
-            cv.set_value('T')
-            c = Cell.objects.get_or_create(boat=boat, row=row, column=col)[0]
-            c.set_value('T')
+        return self.attack_salvo([pos], player, victim)[0]
+
+    def attack_salvo(self, positions, player, victim):
+        """ Fires every position at the victim in one transaction. The board
+        of the victim is loaded once, the shots are appended to the log of
+        the room and the sunk boats, eliminated players and the winner are
+        counted with a few bulk writes whatever the amount of shots. Return
+        a list with 'T' for the hits and 'X' for the misses. If the room
+        has a live actor the salvo is resolved in memory by the actor.
+        Raises turns.NotYourTurn if it is not the turn of player
+        Params:
+            positions -> List of tuples (row, column)
+            player -> Player instance. The player who attacks
+            victim -> Id of victim player
+        """
+        positions = [tuple(pos) for pos in positions]
+        if len(set(positions)) != len(positions):
+            raise ValueError('Posicion repetida')
+        victim = int(victim)
+        result = actors.call(self, 'attack', positions, player.id, victim)
+        if result is None:
+            values, first, sunk, eliminated = self._attack_salvo(positions,
+                    player, victim)
         else:
-            c = Cell.objects.get_or_create(boat=boat, row=row, column=col)[0]
-            c.set_value('X')
+            values, first = result['values'], result['first']
+            sunk, eliminated = result['sunk'], result['eliminated']
+            self.winner = result['winner']
+            self.last_shot = first + len(positions) - 1
+        for i, ((r, c), v) in enumerate(zip(positions, values)):
+            events.publish(self.id, 'shot', player=player.id, victim=victim,
+                    row=r, column=c, value=v, sequence=first+i)
+        for boat in sunk:
+            events.publish(self.id, 'sunk', victim=victim, boat=boat)
+        if eliminated:
+            events.publish(self.id, 'eliminated', player=victim)
+            if self.winner:
+                cache.room_changed(self.id)
+                events.publish(self.id, 'winner', player=self.winner)
+        return values
+
+    def _attack_salvo(self, positions, player, victim):
+        """ Resolves the salvo in the database. Return (values, sequence of
+        the first shot, sunk boats, eliminated)
+        """
+        with transaction.atomic():
+            last = self.next_shot(len(positions))
+            # The room row is locked, the turn can not change until the end
+            if not Player.objects.filter(id=player.id, room=self,
+                    turn=True).exists():
+                raise turns.NotYourTurn('Aun no es tu turno')
+            table_victim = Table.objects.select_related('player').get(
+                    player_id=victim, victim=0)
+            table_player = Table.objects.get(player=player, victim=victim)
+            n = table_victim.get_map_size()
+            if not all(0 <= r < n and 0 <= c < n for r, c in positions):
+                raise ValueError('Posicion fuera del mapa')
+
+            def shoot(board):
+                return [board.shoot(r, c) for r, c in positions]
+
+            if table_victim.packed is None:
+                board = table_victim.get_board().copy()
+                hits = shoot(board)
+                hit_cells = cells_filter(p for p, hit in zip(positions, hits)
+                        if hit)
+                if hit_cells is not None:
+                    Cell.objects.filter(hit_cells, table=table_victim,
+                            value__in=table_victim.get_ocupado()).update(
+                                    value='T',
+                                    version=table_victim.bump_version())
+                    table_victim._board = board
+            else:
+                hits = table_victim.update_packed(shoot)
+                board = table_victim.get_board()
+            values = ['T' if hit else 'X' for hit in hits]
+            shot_cells = dict(zip(positions, values))
+            if table_player.packed is None:
+                boat_aux = Boat.objects.get(table=table_player)
+                version = table_player.bump_version()
+                Cell.objects.filter(cells_filter(shot_cells),
+                        table=table_player).delete()
+                Cell.objects.bulk_create([Cell(table=table_player,
+                    boat=boat_aux, row=r, column=c, value=v, version=version)
+                    for (r, c), v in shot_cells.items()])
+            else:
+                table_player.update_packed(lambda aux: [aux.put(r, c, v)
+                    for (r, c), v in shot_cells.items()])
+            first = last - len(positions) + 1
+            Shot.objects.bulk_create([Shot(room=self, sequence=first+i,
+                shooter=player, victim_id=victim, row=r, column=c, value=v)
+                for i, ((r, c), v) in enumerate(zip(positions, values))])
+            boats = Counter(board.boat_at(r, c)
+                    for (r, c), hit in zip(positions, hits) if hit)
+            sunk, eliminated = [], False
+            if boats:
+                table_victim.snapshot_if_due(last)
+                sunk, eliminated = self.count_hits(victim, boats)
+            table_player.snapshot_if_due(last)
+        if table_victim.packed is None and boats:
+            cache.board_changed(table_victim, board)
+        return values, first, sunk, eliminated
+
+    def count_hits(self, victim, boats):
+        """ Discounts the hits from the boats of the victim and the sunk
+        boats from the ships of the victim. The victim leaves the game when
+        it has no ships left and the last player on game wins. Every step is
+        a conditional update of a counter, so no cell is scanned. Return
+        (list of sunk boat ids, eliminated)
+        Params:
+            victim -> Id of the victim player
+            boats -> Dict boat id -> amount of hits
+        """
+        sunk = []
+        for boat, n in boats.items():
+            if not Boat.objects.filter(id=boat, remaining__gt=n).update(
+                    remaining=models.F('remaining') - n):
+                if Boat.objects.filter(id=boat, remaining=n).update(
+                        remaining=0):
+                    sunk.append(boat)
+        n = len(sunk)
+        if not n or Player.objects.filter(id=victim,
+                ships_left__gt=n).update(
+                        ships_left=models.F('ships_left') - n):
+            return sunk, False
+        eliminated = Player.objects.filter(id=victim, ships_left=n).update(
+                ships_left=0, on_game=False, turn=False, offensive=False,
+                defense=False)
+        if not eliminated:
+            return sunk, False
+        identity.forget(Player)
+        alive = list(Player.objects.filter(room=self,
+            on_game=True).values_list('id', flat=True)[:2])
+        if len(alive) == 1 and Room.objects.filter(id=self.id,
+                winner=0).update(winner=alive[0]):
+            self.winner = alive[0]
+        return sunk, True
 
 
-class Player(models.Model):
+class Player(FieldUpdateMixin, models.Model):
     user = models.ForeignKey(User)
     room = models.ForeignKey(Room)
     name = models.CharField(max_length=20)
@@ -199,6 +517,14 @@ class Player(models.Model):
     admin = models.BooleanField(default=False)
     offensive = models.BooleanField(default=False)
     defense = models.BooleanField(default=False)
+    is_bot = models.BooleanField(default=False)
+    # Boats of the fleet that are not sunk yet
+    ships_left = models.IntegerField(default=0)
+
+    class Meta:
+        # Not unique: every computer player shares the same user
+        index_together = [('user', 'room'), ('room', 'turn'),
+                ('room', 'number_turn')]
 
     def __str__(self):
         return self.name
@@ -208,16 +534,14 @@ class Player(models.Model):
         Params:
             value -> Should be True o False
         """
-        self.offensive = value
-        self.save()
+        self.update_fields(offensive=value)
 
     def set_defense(self, value):
         """ Sets defence attack to value
         Params:
             value -> Should be True o False
         """
-        self.defense = value
-        self.save()
+        self.update_fields(defense=value)
 
     def is_ready(self):
         return self.ready
@@ -227,8 +551,8 @@ class Player(models.Model):
         Params:
             value -> Should be True o False
         """
-        self.ready = value
-        self.save()
+        self.update_fields(ready=value)
+        events.publish(self.room_id, 'ready', player=self.id, ready=value)
 
     def is_admin(self):
         return self.admin
@@ -238,32 +562,28 @@ class Player(models.Model):
         Params:
             value -> Should be True o False
         """
-        self.admin = value
-        self.save()
+        self.update_fields(admin=value)
 
     def set_number_turn(self, value):
         """ Sets turn number to player
         Params:
             value -> Integer greater than 0
         """
-        self.number_turn = value
-        self.save()
+        self.update_fields(number_turn=value)
 
     def set_on_game(self, value):
         """ Puts to the player on game if value is True
         Params:
             value -> Should be True o False
         """
-        self.on_game = value
-        self.save()
+        self.update_fields(on_game=value)
 
     def set_turn(self, value):
         """ Gives turn the player if value is True
         Params:
             value -> Should be True o False
         """
-        self.turn = value
-        self.save()
+        self.update_fields(turn=value)
 
     def get_or_create_victim_table(self, victim):
         """ Return a table of the victim
@@ -274,35 +594,50 @@ class Player(models.Model):
             t = Table.objects.get(player=self, victim=victim)
         except Table.DoesNotExist:
             t = Table.objects.create(player=self, victim=victim)
-            Boat.objects.create(table=t, name='bote_aux')
+            if t.packed is None:
+                Boat.objects.create(table=t, name='bote_aux')
         return t
 
 
 class Table(models.Model):
     player = models.ForeignKey(Player)
     victim = models.IntegerField(default=0)
+    version = models.IntegerField(default=0)
+    # Board.to_bytes() of the table when it does not use Cell rows
+    packed = models.BinaryField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('player', 'victim')
 
     AGUA = 0
-    # P: Portaaviones, A: Acorazado, F: Fragata,
-    # S: submarino, B: botepatrulla
-    OCUPADO = ['P', 'A', 'F', 'S', 'B']
+
+    _board = None
+    _quotas = None
+    _placement = None
 
     def __str__(self):
         size = self.get_map_size()
         return self.player.__str__() + '%d x %d' % (size, size)
 
     def get_absolute_url(self):
-        room = Room.objects.get(id=self.player.room.id)
-        data = {'room': room.id, 'table': self.id}
+        data = {'room': self.player.room_id, 'table': self.id}
         return reverse('my-table-view', kwargs=data)
 
     def get_map_size(self):
-        room = Room.objects.get(id=self.player.room.id)
-        return room.map_size
+        return self.get_room_meta()['map_size']
+
+    def get_room_meta(self):
+        """ Return the cached metadata of the room of the table """
+        return cache.room_meta(self.player.room_id,
+                lambda: self.player.room.get_meta())
+
+    def get_ruleset(self):
+        """ Return the Ruleset of the fleet of the room of the table """
+        return fleet.get_ruleset(self.get_room_meta()['ships'])
 
     def get_ocupado(self):
-        ret = self.OCUPADO.copy()
-        return ret
+        """ Return the list of the values of the cells with boats """
+        return list(self.get_ruleset().occupied)
 
     def get_boat_from_coord(self, row, col):
         """ Return the boat from the coordinates (row, column)
@@ -310,79 +645,140 @@ class Table(models.Model):
             row -> Positive integer
             col -> Positive integer
         """
-        boats = Boat.objects.filter(table=self)
-        for boat in boats:
-            cells = boat.get_boat()
-            for r, c, v in cells:
-                if r == row and c == col:
-                    return boat
+        boat_id = self.get_boat_id_from_coord(row, col)
+        if boat_id is None:
+            return None
+        return Boat.objects.get(id=boat_id)
+
+    def get_boat_id_from_coord(self, row, col):
+        """ Return the id of the boat in (row, column) or None. The board
+        keeps the boat of every cell
+        Params:
+            row -> Positive integer
+            col -> Positive integer
+        """
+        return self.get_board().boat_at(row, col)
+
+    def get_boat_quotas(self):
+        """ Return a dict with the amount of boats of each type that still
+        can be added. The boats are counted with a single query and the
+        result is kept in the table until a boat is placed
+        """
+        if self._quotas is None:
+            amounts = Boat.objects.filter(table=self).values(
+                    'name').annotate(amount=models.Count('id'))
+            amounts = {a['name']: a['amount'] for a in amounts}
+            self._quotas = self.get_ruleset().quotas(amounts)
+        return self._quotas
+
+    def add_boat_type_available(self, boat_type):
+        """ Check if it's possible to add more boats of boat_type """
+        return self.get_boat_quotas().get(boat_type.lower(), 0) > 0
 
     def add_boat_available(self):
         """ Check if it's possible to add more boat """
-        res = self.add_aircraft_carrier_available() or \
-                self.add_battleship_available() or \
-                self.add_frigate_available() or \
-                self.add_submarine_available() or \
-                self.add_patrol_boat_available()
-        return res
+        return any(q > 0 for q in self.get_boat_quotas().values())
 
     def add_aircraft_carrier_available(self):
         """ Check if it's possible to add more aircraft carrier """
-        room = Room.objects.get(id=self.player.room.id)
-        aircraft_carriers = Boat.objects.filter(table=self,
-                name='portaaviones')
-        return len(aircraft_carriers) < room.get_amount_aircraft_carrier()
+        return self.add_boat_type_available('portaaviones')
 
     def add_battleship_available(self):
         """ Check if it's possible to add more battleship """
-        room = Room.objects.get(id=self.player.room.id)
-        battleships = Boat.objects.filter(table=self, name='acorazado')
-        return len(battleships) < room.get_amount_battleship()
+        return self.add_boat_type_available('acorazado')
 
     def add_frigate_available(self):
         """ Check if it's possible to add more frigate """
-        room = Room.objects.get(id=self.player.room.id)
-        frigates = Boat.objects.filter(table=self, name='fragata')
-        return len(frigates) < room.get_amount_frigate()
+        return self.add_boat_type_available('fragata')
 
     def add_submarine_available(self):
         """ Check if it's possible to add more submarine """
-        room = Room.objects.get(id=self.player.room.id)
-        submarines = Boat.objects.filter(table=self, name='submarino')
-        return len(submarines) < room.get_amount_submarine()
+        return self.add_boat_type_available('submarino')
 
     def add_patrol_boat_available(self):
         """ Check if it's possible to add more patrol boat """
-        room = Room.objects.get(id=self.player.room.id)
-        patrol_boats = Boat.objects.filter(table=self, name='botepatrulla')
-        return len(patrol_boats) < room.get_amount_patrol_boat()
+        return self.add_boat_type_available('botepatrulla')
 
     def set_boat(self, pos, orientation, boat_type):
         """ Puts a boat type in the coordinates (row, column) with some
-        orientation
+        orientation. Return True if the boat was placed
         Params:
             pos -> (row, column) Positive integer
             orientation -> 'H' Horizontal or 'V' Vertical
             boat_type -> String It can be portaaviones, acorazado,
                          fragata, submarino or botepatrulla
         """
-        if self.position_is_valid(pos, orientation, boat_type) and \
-                self.add_boat_available():
-            row, col = pos
-            boat_size = BOAT_SIZE[boat_type.lower()]
-            v = boat_type.capitalize()[0]
-            if orientation.upper() == 'H':
-                boat = Boat.objects.create(table=self, name=boat_type.lower())
-                for j in range(boat_size):
-                    Cell.objects.create(boat=boat, column=col, row=row,
-                            value=v)
-                    col += 1
-            if orientation.upper() == 'V':
-                boat = Boat.objects.create(table=self, name=boat_type.lower())
-                for i in range(boat_size):
-                    Cell.objects.create(boat=boat, column=col, row=row,
-                            value=v)
-                    row += 1
+        return self.set_fleet([(pos, orientation, boat_type)])
+
+    def set_fleet(self, boats):
+        """ Puts every boat of the fleet validating them against the
+        placement masks of the table and saving the boats and their cells in
+        one transaction. Nothing is saved if some boat can not be placed.
+        Return True if the whole fleet was placed
+        Params:
+            boats -> List of (pos, orientation, boat_type)
+        """
+        board = self.get_board().copy()
+        placement = self.get_placement().copy()
+        rules = self.get_ruleset()
+        quotas = dict(self.get_boat_quotas())
+        placements = []
+        try:
+            for item in boats:
+                pos, orientation, boat_type = item
+                boat_type = boat_type.lower()
+                row, col = pos
+                boat_size = rules.sizes[boat_type]
+                if quotas[boat_type] <= 0 or not placement.is_legal(row, col,
+                        boat_size, orientation):
+                    return False
+                quotas[boat_type] -= 1
+                v = rules.letters[boat_type]
+                cells = rules.footprint(row, col, boat_type, orientation)
+                for r, c in cells:
+                    board.put(r, c, v)
+                placement.place(cells)
+                placements.append((boat_type, v, cells))
+        except (TypeError, KeyError, ValueError, AttributeError):
+            logger.info('Invalid boat %r in table %d', item, self.id)
+            return False
+
+        with transaction.atomic():
+            # The board was loaded at self.version, nothing is saved if
+            # another request changed the table meanwhile
+            if self.packed is None and not Table.objects.filter(id=self.id,
+                    version=self.version).update(version=self.version + 1):
+                return False
+            last_id = Boat.objects.filter(table=self).aggregate(
+                    last=models.Max('id'))['last'] or 0
+            boats = Boat.objects.bulk_create([Boat(table=self, name=name,
+                remaining=len(cells)) for name, v, cells in placements])
+            Player.objects.filter(id=self.player_id).update(
+                    ships_left=models.F('ships_left') + len(boats))
+            if any(boat.pk is None for boat in boats):
+                # The backend does not return the ids of bulk inserts
+                boats = list(Boat.objects.filter(table=self,
+                    id__gt=last_id).order_by('id'))
+            for boat, (name, v, cells) in zip(boats, placements):
+                for r, c in cells:
+                    board.put(r, c, v, boat.id)
+            if self.packed is None:
+                self.version += 1
+                Cell.objects.bulk_create([
+                    Cell(table=self, boat=boat, row=r, column=c, value=v,
+                        version=self.version)
+                    for boat, (name, v, cells) in zip(boats, placements)
+                    for r, c in cells])
+            elif not self.save_packed(board):
+                # Another request changed the table meanwhile
+                transaction.set_rollback(True)
+                return False
+        self._board = board
+        self._placement = placement
+        cache.board_changed(self, board)
+        cache.placement_changed(self, placement)
+        self._quotas = quotas
+        return True
 
     def position_is_valid(self, pos, orientation, boat_type):
         """ Check if it position is correct
@@ -394,34 +790,164 @@ class Table(models.Model):
         """
         try:
             row, col = pos
-            boat_size = BOAT_SIZE[boat_type.lower()]
-            table = self.get_table(extended=True)
-            map_size = self.get_map_size()
-            row_valid = row >= 0 and row < map_size
-            column_valid = col >= 0 and col < map_size
-            if not row_valid or not column_valid:
-                return False
-            if orientation.upper() == 'H':
-                if col+boat_size-1 >= map_size:
-                    return False
-                for i in range(row, row+2):
-                    for j in range(col, col+boat_size+1):
-                        if table[i][j] in self.OCUPADO:
-                            return False
-            elif orientation.upper() == 'V':
-                if row+boat_size-1 >= map_size:
-                    return False
-                for i in range(row, row+boat_size+1):
-                    for j in range(col, col+2):
-                        if table[i][j] in self.OCUPADO:
-                            return False
-            else:
-                return False
-            return True
-        except (TypeError, KeyError):
-            print('Posicion invalida o no existe ese tipo de barco')
+            boat_size = self.get_ruleset().sizes[boat_type.lower()]
+            return self.get_placement().is_legal(row, col, boat_size,
+                    orientation)
+        except (TypeError, KeyError, ValueError, AttributeError):
+            logger.info('Invalid boat %r in table %d', (pos, orientation,
+                boat_type), self.id)
             return False
 
+    def get_placement(self):
+        """ Return the PlacementMasks with the legal anchors of every boat
+        of the room in the table. They are built from the board once per
+        version of the table
+        """
+        if self._placement is None:
+            sizes = self.get_ruleset().sizes.values()
+            self._placement = cache.placement(self,
+                    lambda: PlacementMasks.from_board(self.get_board(),
+                        sizes))
+        return self._placement
+
+    def save(self, *args, **kwargs):
+        if self.pk is None and self.packed is None and getattr(settings,
+                'BATTLESHIP_BOARD_STORAGE', 'cells') == 'packed':
+            self.packed = Board(self.get_map_size()).to_bytes(
+                    boats=self.victim == 0)
+        super(Table, self).save(*args, **kwargs)
+
+    def save_packed(self, board):
+        """ Writes the packed board and increments the version if the table
+        is still at the version it was loaded. Return False otherwise
+        """
+        data = board.to_bytes(boats=self.victim == 0)
+        saved = Table.objects.filter(id=self.id,
+                version=self.version).update(packed=data,
+                        version=self.version + 1)
+        if saved:
+            self.packed = data
+            self.version += 1
+            self._board = board
+        return bool(saved)
+
+    def update_packed(self, change):
+        """ Applies change to the packed board and saves it, loading the
+        table again and retrying if another request saved it meanwhile.
+        Nothing is saved if change left the board as it was, so the version
+        only moves with the board, as with the cells. Return what change
+        returns
+        Params:
+            change -> Function that receives a Board and modifies it
+        """
+        while True:
+            data = bytes(self.packed)
+            board = Board.from_bytes(self.get_map_size(), data,
+                    self.get_ocupado())
+            res = change(board)
+            if board.to_bytes(boats=self.victim == 0) == data or \
+                    self.save_packed(board):
+                return res
+            self.refresh_from_db(fields=['packed', 'version'])
+
+    def bump_version(self):
+        """ Increments the version of the table and return the new one """
+        Table.objects.filter(id=self.id).update(
+                version=models.F('version') + 1)
+        self.version = Table.objects.values_list('version',
+                flat=True).get(id=self.id)
+        return self.version
+
+    def get_version(self):
+        """ Return the version of the table, the one kept by the actor of
+        the room while it owns the table since the database is only written
+        when the actor flushes
+        """
+        version = actors.get_version(self)
+        return self.version if version is None else version
+
+    def get_changes(self, version):
+        """ Return a list of (row, column, value) of the cells that changed
+        after version or None if the storage of the table does not keep it
+        or the changes are still in the actor of the room
+        """
+        if self.packed is not None or actors.get_version(self) is not None:
+            return None
+        return list(Cell.objects.filter(table=self,
+            version__gt=version).values_list('row', 'column', 'value'))
+
+    def snapshot_if_due(self, sequence):
+        """ Saves the board of the table after the shot sequence every
+        BATTLESHIP_SNAPSHOT_INTERVAL versions of the table, so rebuilding it
+        never replays more shots than that
+        """
+        interval = getattr(settings, 'BATTLESHIP_SNAPSHOT_INTERVAL', 20)
+        if interval and self.version % interval == 0:
+            BoardSnapshot.objects.create(table=self, sequence=sequence,
+                    data=self.get_board().to_bytes(boats=self.victim == 0))
+
+    def get_fleet_board(self):
+        """ Return the Board of the table before the first shot: the
+        hits of the current board are turned back into the boats
+        """
+        board = self.get_board().copy()
+        hit = ord('T')
+        if hit in board.cells:
+            letters = self.get_ruleset().letters
+            names = dict(Boat.objects.filter(table=self).values_list('id',
+                'name'))
+            for i, v in enumerate(board.cells):
+                letter = letters.get(names.get(board.boats[i]))
+                if v == hit and letter:
+                    board.cells[i] = ord(letter)
+        return board
+
+    def get_board_at(self, sequence):
+        """ Return the Board of the table as it was after the shot number
+        sequence of the room, rebuilt from the last snapshot before it and
+        the shots logged after the snapshot
+        Params:
+            sequence -> Sequence number of a shot of the room
+        """
+        snapshot = BoardSnapshot.objects.filter(table=self,
+                sequence__lte=sequence).order_by('-sequence').first()
+        if snapshot is not None:
+            board = Board.from_bytes(self.get_map_size(),
+                    bytes(snapshot.data), self.get_ocupado())
+            start = snapshot.sequence
+        elif self.victim == 0:
+            board, start = self.get_fleet_board(), 0
+        else:
+            board, start = Board(self.get_map_size(), self.get_ocupado()), 0
+        shots = Shot.objects.filter(room_id=self.player.room_id,
+                sequence__gt=start, sequence__lte=sequence)
+        if self.victim == 0:
+            shots = shots.filter(victim_id=self.player_id, value='T')
+        else:
+            shots = shots.filter(shooter_id=self.player_id,
+                    victim_id=self.victim)
+        for row, col, value in shots.values_list('row', 'column', 'value'):
+            board.put(row, col, value)
+        return board
+
+    def get_board(self):
+        """ Return the Board of the table. It is built with a single query
+        the first time and reused until the table changes, or taken from the
+        actor of the room while it owns the table
+        """
+        if self._board is None:
+            self._board = actors.get_board(self) or cache.get_board(self,
+                    self._load_board)
+        return self._board
+
+    def _load_board(self):
+        if self.packed is not None:
+            return Board.from_bytes(self.get_map_size(), bytes(self.packed),
+                    self.get_ocupado())
+        cells = Cell.objects.filter(table=self).values_list('row', 'column',
+                'value', 'boat_id')
+        return Board.from_cells(self.get_map_size(), cells, self.get_ocupado())
+
     def get_table(self, extended=False, enumerated=False):
         """ Return a matrix NxN where N is the map size or N+1xN+1 if
         extended is True and with numbers coordinate if enumerated is True
@@ -430,37 +956,22 @@ class Table(models.Model):
             enumerated -> True o False A table with number of rows and columns
                           if it is True
         """
-        table_size = self.get_map_size()
-        if extended:
-            table_size += 1
-        table = []
-        for i in range(0, table_size):
-            row = []
-            for j in range(0, table_size):
-                row.append(self.AGUA)
-            table.append(row)
-        boats = Boat.objects.filter(table=self)
-        for boat in boats:
-            cells = boat.get_boat()
-            for row, col, value in cells:
-                if extended:
-                    table[row+1][col+1] = value
-                else:
-                    table[row][col] = value
+        table = self.get_board().to_matrix(extended)
         if enumerated:
-            row = [str(j) for j in range(1, table_size+1)]
-            table.insert(0, row)
-            n = 0
-            for r in table:
-                r.insert(0, str(n))
-                n += 1
-            table[0][0] = ''
+            header = [''] + [str(j) for j in range(1, len(table)+1)]
+            table = [header] + [[str(i)] + row
+                    for i, row in enumerate(table, 1)]
         return table
 
 
 class Boat(models.Model):
     table = models.ForeignKey(Table)
     name = models.CharField(max_length=20)
+    # Cells of the boat that were not hit yet
+    remaining = models.IntegerField(default=0)
+
+    class Meta:
+        index_together = ('table', 'name')
 
     def __str__(self):
         return str(self.table.id) + '-' + self.name
@@ -471,15 +982,74 @@ class Boat(models.Model):
         res = [(cell.row, cell.column, cell.value) for cell in cells]
         return res
 
-class Cell(models.Model):
+class Cell(FieldUpdateMixin, models.Model):
+    table = models.ForeignKey(Table)
     boat = models.ForeignKey(Boat)
     column = models.IntegerField()
     row = models.IntegerField()
     value = models.CharField(max_length=2, default="")
+    # Version of the table when the cell was written
+    version = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('table', 'row', 'column')
+        index_together = [('table', 'version'), ('boat', 'row', 'column')]
 
     def __str__(self):
         return "(%s, %d, %s)" % (self.row, self.column, self.value)
 
     def set_value(self, value):
-        self.value = value
-        self.save()
+        self.update_fields(value=value)
+
+
+class Shot(models.Model):
+    """ Append-only log of the shots of a room """
+    room = models.ForeignKey(Room)
+    # Position of the shot in the room, starting from 1
+    sequence = models.IntegerField()
+    shooter = models.ForeignKey(Player, related_name='shots_fired')
+    victim = models.ForeignKey(Player, related_name='shots_received')
+    row = models.IntegerField()
+    column = models.IntegerField()
+    # T: hit, X: miss
+    value = models.CharField(max_length=2)
+
+    class Meta:
+        unique_together = ('room', 'sequence')
+        index_together = [('victim', 'sequence'),
+                ('shooter', 'victim', 'sequence')]
+        ordering = ['sequence']
+
+    def __str__(self):
+        return "%d: (%d, %d, %s)" % (self.sequence, self.row, self.column,
+                self.value)
+
+
+class BoardSnapshot(models.Model):
+    """ Board of a table after the shot sequence of its room """
+    table = models.ForeignKey(Table)
+    sequence = models.IntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        unique_together = ('table', 'sequence')
+
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def invalidate_room(sender, instance, **kwargs):
+    cache.room_changed(instance.id)
+
+
+@receiver(post_save, sender=ShipType)
+@receiver(post_delete, sender=ShipType)
+def invalidate_spec_rooms(sender, instance, **kwargs):
+    for room_id in Room.objects.filter(
+            fleet_spec_id=instance.spec_id).values_list('id', flat=True):
+        cache.room_changed(room_id)
+
+
+@receiver(post_save, sender=Player)
+@receiver(post_delete, sender=Player)
+def invalidate_lobby(sender, **kwargs):
+    cache.bump('lobby')
@@ -0,0 +1,126 @@
+class PlacementMasks(object):
+    """ Legal anchors of every boat size and orientation of a board.
+
+    The occupancy of every row and the legal anchors of every
+    (size, orientation) are kept as one integer per row, where the bit c is
+    the column c, so checking an anchor is O(1) and placing a boat only
+    recomputes the rows around it. The rule is the one of Board.fits: the
+    cells of the boat and the ones above and on its left must be free.
+    """
+    ORIENTATIONS = ('H', 'V')
+
+    def __init__(self, size, occupancy, sizes):
+        """
+        Params:
+            size -> Positive integer, the map size
+            occupancy -> List with the occupied bits of every row
+            sizes -> Iterable of boat sizes
+        """
+        self.size = size
+        self.full = (1 << size) - 1
+        self.occupancy = list(occupancy)
+        self.masks = {}
+        for boat_size in set(sizes):
+            for orientation in self.ORIENTATIONS:
+                self.masks[(boat_size, orientation)] = [
+                    self._row_mask(r, boat_size, orientation)
+                    for r in range(size)]
+
+    @classmethod
+    def from_board(cls, board, sizes):
+        """ Build the masks of the cells occupied in a Board """
+        n = board.size
+        occupancy = []
+        for r in range(n):
+            bits = 0
+            for c in range(n):
+                if board.is_occupied(r, c):
+                    bits |= 1 << c
+            occupancy.append(bits)
+        return cls(n, occupancy, sizes)
+
+    def _row_mask(self, row, boat_size, orientation):
+        """ Return the legal anchors of the row """
+        n = self.size
+        if orientation == 'H':
+            if boat_size > n:
+                return 0
+            blocked = self.occupancy[row]
+            if row > 0:
+                blocked |= self.occupancy[row-1]
+            # Anchor c is illegal if a column in c-1 .. c+boat_size-1 is
+            bad = blocked << 1
+            for k in range(boat_size):
+                bad |= blocked >> k
+            return ~bad & ((1 << (n-boat_size+1)) - 1)
+        if row + boat_size > n:
+            return 0
+        blocked = 0
+        for r in range(max(row-1, 0), row+boat_size):
+            blocked |= self.occupancy[r]
+        return ~(blocked | blocked << 1) & self.full
+
+    def is_legal(self, row, col, boat_size, orientation):
+        """ Check in O(1) if a boat can be anchored in (row, column) """
+        rows = self.masks.get((boat_size, orientation.upper()))
+        if rows is None or not (0 <= row < self.size and
+                0 <= col < self.size):
+            return False
+        return bool(rows[row] >> col & 1)
+
+    def mask(self, boat_size, orientation):
+        """ Return the legal anchors as one integer where the bit
+        row * size + column is the anchor (row, column)
+        """
+        mask = 0
+        for r, bits in enumerate(self.masks[(boat_size, orientation)]):
+            mask |= bits << (r * self.size)
+        return mask
+
+    def anchors(self, boat_size, orientation):
+        """ Return the list of legal (row, column) anchors """
+        res = []
+        for r, bits in enumerate(self.masks[(boat_size, orientation)]):
+            while bits:
+                low = bits & -bits
+                res.append((r, low.bit_length() - 1))
+                bits ^= low
+        return res
+
+    def rows_and_columns(self, sizes):
+        """ Return the sorted lists of rows and of columns that have a legal
+        anchor of some boat of sizes in some orientation
+        """
+        rows, columns = set(), 0
+        for boat_size in set(sizes):
+            for orientation in self.ORIENTATIONS:
+                for r, bits in enumerate(self.masks[(boat_size,
+                        orientation)]):
+                    if bits:
+                        rows.add(r)
+                        columns |= bits
+        return sorted(rows), [c for c in range(self.size) if columns >> c & 1]
+
+    def place(self, cells):
+        """ Marks cells, a list of (row, column), as occupied and updates
+        the rows whose anchors can reach them
+        """
+        rows = set(r for r, c in cells)
+        for r, c in cells:
+            self.occupancy[r] |= 1 << c
+        low, high = min(rows), max(rows)
+        for (boat_size, orientation), masks in self.masks.items():
+            if orientation == 'H':
+                changed = range(low, min(high+2, self.size))
+            else:
+                changed = range(max(low-boat_size+1, 0),
+                        min(high+2, self.size))
+            for r in changed:
+                masks[r] = self._row_mask(r, boat_size, orientation)
+
+    def copy(self):
+        masks = PlacementMasks.__new__(PlacementMasks)
+        masks.size, masks.full = self.size, self.full
+        masks.occupancy = list(self.occupancy)
+        masks.masks = {k: list(v) for k, v in self.masks.items()}
+        return masks
@@ -0,0 +1,214 @@
+import hashlib
+import http.client
+import itertools
+import logging
+import re
+import threading
+import time
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+logger = logging.getLogger(__name__)
+
+# The urls of a room, including the ones of the api
+ROOM_PATH = re.compile(r'^/(?:api/v1/)?room-(?P<room>[0-9]+)/')
+
+# Header with the secret shared by the router and the workers
+SECRET_HEADER = 'X-Battleship-Router'
+
+HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-authenticate',
+        'proxy-authorization', 'te', 'trailers', 'transfer-encoding',
+        'upgrade'}
+
+
+class Refused(Exception):
+    """ The worker refused the connection, the request was not sent """
+
+
+def room_of(path):
+    """ Return the id of the room of the url path or None """
+    match = ROOM_PATH.match(path)
+    return int(match.group('room')) if match else None
+
+
+def score(room, worker):
+    """ Weight of worker for room, the highest one owns the room. Removing
+    a worker only moves the rooms that it owned (rendezvous hashing)
+    """
+    return hashlib.md5(('%s:%s' % (room, worker)).encode()).digest()
+
+
+class Router(object):
+    """ WSGI application that forwards the urls of every room to the worker
+    that owns the room, so the state of a room (its actor and its events)
+    lives in one process.
+
+    Workers are checked every check_interval seconds and a worker that
+    refuses a connection is taken out at once; its rooms move to the next
+    worker by rendezvous hashing. When a room moves away from a worker
+    that is still alive, the router first asks it to release the room, so
+    the new owner loads it after the last flush.
+    """
+
+    def __init__(self, workers, secret='', check_interval=2.0,
+            timeout=60):
+        """
+        Params:
+            workers -> List of base urls, e.g. http://127.0.0.1:8001
+            secret -> Value of SECRET_HEADER for the release requests
+        """
+        self.workers = list(workers)
+        self.secret = secret
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.alive = set(self.workers)
+        self.owners = {}
+        self.lock = threading.Lock()
+        self._next = itertools.cycle(self.workers)
+        self._checker = None
+
+    def start_checks(self):
+        """ Starts the thread that checks the health of the workers """
+        self._checker = threading.Thread(target=self._check_loop,
+                name='router-health', daemon=True)
+        self._checker.start()
+
+    def _check_loop(self):
+        while True:
+            for worker in self.workers:
+                self.set_alive(worker, self.is_healthy(worker))
+            time.sleep(self.check_interval)
+
+    def _connection(self, worker, timeout=None):
+        url = urlsplit(worker)
+        return http.client.HTTPConnection(url.hostname, url.port or 80,
+                timeout=timeout or self.timeout)
+
+    def is_healthy(self, worker):
+        try:
+            conn = self._connection(worker, timeout=2)
+            conn.request('GET', '/health')
+            ok = conn.getresponse().status == 200
+            conn.close()
+            return ok
+        except (OSError, http.client.HTTPException):
+            return False
+
+    def set_alive(self, worker, alive):
+        with self.lock:
+            if alive and worker not in self.alive:
+                logger.warning('Worker %s is back', worker)
+                self.alive.add(worker)
+            elif not alive and worker in self.alive:
+                logger.warning('Worker %s is down, its rooms move', worker)
+                self.alive.discard(worker)
+
+    def owner(self, room, exclude=()):
+        """ Return the worker that owns room (None for the urls that are not
+        of a room) among the alive ones, or None if every worker is down
+        """
+        with self.lock:
+            alive = [w for w in self.workers
+                    if w in self.alive and w not in exclude]
+            if not alive:
+                return None
+            if room is None:
+                for worker in self._next:
+                    if worker in alive:
+                        return worker
+            worker = max(alive, key=lambda w: score(room, w))
+            previous = self.owners.get(room)
+            self.owners[room] = worker
+            handoff = previous is not None and previous != worker and \
+                    previous in self.alive
+        if handoff:
+            self.release(previous, room)
+        return worker
+
+    def release(self, worker, room):
+        """ Asks worker to flush and drop the state of room """
+        try:
+            conn = self._connection(worker)
+            conn.request('POST', '/internal/room-%d/release' % room,
+                    headers={SECRET_HEADER: self.secret})
+            conn.getresponse().read()
+            conn.close()
+        except (OSError, http.client.HTTPException):
+            logger.warning('Worker %s did not release room %d', worker, room)
+
+    def forward(self, worker, environ, body):
+        """ Sends the request to worker. Return (status, headers, body).
+        Raises Refused if the worker refuses the connection, so the request
+        can be sent to another one
+        """
+        conn = self._connection(worker)
+        try:
+            conn.connect()
+        except OSError as e:
+            raise Refused(str(e))
+        path = environ.get('PATH_INFO', '/')
+        if environ.get('QUERY_STRING'):
+            path += '?' + environ['QUERY_STRING']
+        headers = {key[5:].replace('_', '-').title(): value
+                for key, value in environ.items()
+                if key.startswith('HTTP_')}
+        for key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            if environ.get(key):
+                headers[key.replace('_', '-').title()] = environ[key]
+        headers['X-Forwarded-For'] = environ.get('REMOTE_ADDR', '')
+        headers.pop('Connection', None)
+        conn.request(environ['REQUEST_METHOD'], path, body, headers)
+        response = conn.getresponse()
+        data = response.read()
+        conn.close()
+        status = '%d %s' % (response.status, response.reason)
+        headers = [(k, v) for k, v in response.getheaders()
+                if k.lower() not in HOP_BY_HOP]
+        return status, headers, data
+
+    def __call__(self, environ, start_response):
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = environ['wsgi.input'].read(length) if length else None
+        room = room_of(environ.get('PATH_INFO', '/'))
+        tried = set()
+        while True:
+            worker = self.owner(room, exclude=tried)
+            if worker is None:
+                start_response('503 Service Unavailable',
+                        [('Content-Type', 'text/plain')])
+                return [b'No hay servidores disponibles\n']
+            try:
+                status, headers, data = self.forward(worker, environ, body)
+            except Refused:
+                self.set_alive(worker, False)
+                tried.add(worker)
+                continue
+            except (OSError, http.client.HTTPException):
+                # The request may have been run, it is not sent again. A
+                # closed connection is a ConnectionError too, so the refused
+                # ones have their own exception
+                self.set_alive(worker, False)
+                start_response('502 Bad Gateway',
+                        [('Content-Type', 'text/plain')])
+                return [b'El servidor no respondio\n']
+            headers.append(('X-Battleship-Worker', worker))
+            start_response(status, headers)
+            return [data]
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        logger.info(format, *args)
+
+
+def serve(router, host, port):
+    """ Serves the router until the process is stopped """
+    server = ThreadingWSGIServer((host, port), QuietHandler)
+    server.set_app(router)
+    router.start_checks()
+    server.serve_forever()
@@ -0,0 +1,39 @@
+from django import template
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe
+
+from battleship import cache
+
+register = template.Library()
+
+LABEL = '<td align="center">%s</td>'
+CELL = '<td bgcolor="00FFFF" align="center">%s</td>'
+
+
+def board_html(board):
+    """ Return the rows of the board as html in a single pass, with the
+    numbers of rows and columns as labels
+    """
+    n = board.size
+    cells = {}
+    for v in set(board.cells):
+        cells[v] = CELL % (conditional_escape(chr(v)) if v else '')
+    header = [LABEL % ''] + [LABEL % j for j in range(1, n+1)]
+    html = ['<tr>', ''.join(header), '</tr>']
+    for r in range(n):
+        html.append('<tr>')
+        html.append(LABEL % (r+1))
+        html.extend(cells[v] for v in board.cells[r*n:(r+1)*n])
+        html.append('</tr>')
+    return ''.join(html)
+
+
+@register.simple_tag
+def render_board(table):
+    """ Render the rows of a Table. The html is cached by the version of the
+    table
+    """
+    if not table:
+        return ''
+    html = cache.board_html(table, lambda: board_html(table.get_board()))
+    return mark_safe(html)
@@ -1,3 +1,1171 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import random
+import socket
+import socketserver
+import sys
+import threading
+from array import array
+from wsgiref.util import setup_testing_defaults
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.core.wsgi import get_wsgi_application
+from django.db.models import ProtectedError
+from django.http import Http404, HttpResponse
+from django.test import (
+        SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+        )
+from django.urls import reverse
+
+from . import (
+        actors, ai, asgi, cache, events, identity, lobby, router, turns,
+        )
+from .board import Board
+from .models import (
+        Boat, BoardSnapshot, FleetSpec, Player, Room, ShipType, Shot, Table,
+        )
+from .placement import PlacementMasks
+from .templatetags.board_tags import render_board
+
+
+def create_room(players=2, map_size=10, **fields):
+    """ Return a room with players that have their fleet placed and are
+    ready, and the list of players
+    """
+    room = Room.objects.create(name='sala', map_size=map_size, **fields)
+    rng = random.Random(1)
+    res = []
+    for i in range(players):
+        user = User.objects.create_user('jugador%d' % i, password='clave')
+        player = Player.objects.create(user=user, room=room,
+                name='jugador%d' % i)
+        table = Table.objects.create(player=player)
+        ai.place_fleet(table, rng)
+        player.set_ready(True)
+        res.append(player)
+    room.set_admin(res[0].user)
+    return room, res
+
+
+class ComputerPlayerTest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def test_bot_without_room_for_its_fleet(self):
+        room = Room.objects.create(name='sala', map_size=5)
+        rng = random.Random(2)
+        results = [ai.add_bot(room, rng=rng) for i in range(20)]
+        self.assertIn(None, results)
+        bots = Player.objects.filter(room=room)
+        self.assertEqual(bots.count(), len([p for p in results if p]))
+        for bot in bots:
+            self.assertTrue(bot.ready)
+            self.assertEqual(bot.ships_left, 5)
+
+    def test_targets_boats_afloat(self):
+        room, (shooter, victim) = create_room()
+        room.start_game()
+        shooter.get_or_create_victim_table(victim.id)
+        table = Table.objects.get(player=victim, victim=0)
+        boat = table.boat_set.get(name='botepatrulla')
+        cells = [(r, c) for r in range(10) for c in range(10)
+                if table.get_board().boat_at(r, c) == boat.id]
+        self.assertEqual(sorted(room.get_afloat_sizes(victim.id)),
+                [2, 3, 3, 4, 5])
+        room.attack_salvo(cells, shooter, victim.id)
+        self.assertEqual(sorted(room.get_afloat_sizes(victim.id)),
+                [3, 3, 4, 5])
+
+    def test_bots_finish_the_game(self):
+        room, (human,) = create_room(1)
+        rng = random.Random(3)
+        bots = [ai.add_bot(room, rng=rng).id for i in range(2)]
+        room.start_game()
+        for i in range(200):
+            if room.winner:
+                break
+            room.end_shift(Player.objects.get(id=human.id))
+        self.assertIn(room.winner, bots)
+        self.assertEqual(Room.objects.get(id=room.id).winner, room.winner)
+        self.assertEqual(room.get_players_on_game(), [room.winner])
+        self.assertFalse(Player.objects.get(id=human.id).on_game)
+
+    def test_density_scores(self):
+        board = Board(4)
+        board.put(0, 1, 'X')
+        board.put(2, 2, 'T')
+        score = ai.density(board, [2])
+        # Cell (0, 0): only the vertical position from (0, 0) is possible
+        self.assertEqual(score[0], 1)
+        self.assertEqual(score[1], 0)
+        self.assertEqual(score[2*4+2], 0)
+        # Cell (2, 3): horizontal from (2, 2) with the hit, vertical from
+        # (1, 3) and (2, 3)
+        self.assertEqual(score[2*4+3], (1 + ai.HIT_WEIGHT) + 2)
+        self.assertEqual(ai.choose_shot(board, [2]) in [(1, 2), (2, 1),
+            (2, 3), (3, 2)], True)
+
+
+class BoardBytesTest(SimpleTestCase):
+
+    def setUp(self):
+        self.board = Board(3, 'P')
+        self.board.put(0, 0, 'P', 70000)
+        self.board.put(0, 1, 'P', 70000)
+        self.board.put(2, 2, 'X')
+
+    def test_round_trip(self):
+        data = self.board.to_bytes()
+        self.assertEqual(len(data), 9 + 9 * 4)
+        board = Board.from_bytes(3, data, 'P')
+        self.assertEqual(board.cells, self.board.cells)
+        self.assertEqual(board.boat_at(0, 1), 70000)
+        self.assertTrue(board.is_occupied(0, 0))
+        self.assertEqual(Board.from_bytes(3, self.board.to_bytes(
+            boats=False)).get(2, 2), 'X')
+
+    def test_encode(self):
+        self.assertEqual(self.board.encode(), [['P', 2], ['', 6], ['X', 1]])
+        self.assertEqual(Board(2).encode(), [['', 4]])
+
+    def test_eight_byte_ids(self):
+        ids = array('q', self.board.boats)
+        if sys.byteorder == 'big':
+            ids.byteswap()
+        board = Board.from_bytes(3, bytes(self.board.cells) + ids.tobytes())
+        self.assertEqual(board.boat_at(0, 0), 70000)
+        self.assertEqual(board.boats.typecode, 'i')
+
+
+class PlacementMasksTest(SimpleTestCase):
+    """ The masks follow the same rule as Board.fits """
+
+    def check_same_as_fits(self, board, masks, sizes):
+        n = board.size
+        for size in sizes:
+            for orientation in PlacementMasks.ORIENTATIONS:
+                for r in range(n):
+                    for c in range(n):
+                        self.assertEqual(masks.is_legal(r, c, size,
+                            orientation), board.fits(r, c, size,
+                                orientation), (r, c, size, orientation))
+
+    def test_random_boards(self):
+        rng = random.Random(4)
+        sizes = [1, 2, 3, 5]
+        for n in (1, 5, 8):
+            board = Board(n, 'P')
+            masks = PlacementMasks.from_board(board, sizes)
+            for i in range(n):
+                size = rng.choice(sizes)
+                orientation = rng.choice(PlacementMasks.ORIENTATIONS)
+                r, c = rng.randrange(n), rng.randrange(n)
+                if not board.fits(r, c, size, orientation):
+                    continue
+                cells = Board.footprint(r, c, size, orientation)
+                for row, col in cells:
+                    board.put(row, col, 'P')
+                masks.place(cells)
+                self.check_same_as_fits(board,
+                        PlacementMasks.from_board(board, sizes), sizes)
+                self.check_same_as_fits(board, masks, sizes)
+
+    def test_anchors(self):
+        board = Board(3, 'P')
+        board.put(1, 1, 'P')
+        masks = PlacementMasks.from_board(board, [2])
+        self.assertEqual(masks.anchors(2, 'H'), [(0, 0), (0, 1)])
+        self.assertEqual(masks.anchors(2, 'V'), [(0, 0), (1, 0)])
+        self.assertFalse(masks.is_legal(3, 0, 2, 'H'))
+        self.assertFalse(masks.is_legal(0, 0, 4, 'H'))
+
+
+class SetFleetTest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.room = Room.objects.create(name='sala', map_size=10)
+        user = User.objects.create_user('jugador0', password='clave')
+        self.player = Player.objects.create(user=user, room=self.room,
+                name='jugador0')
+
+    def check_stale_table(self):
+        table = Table.objects.create(player=self.player)
+        stale = Table.objects.get(id=table.id)
+        stale.get_board()
+        self.assertTrue(table.set_boat((0, 0), 'H', 'portaaviones'))
+        self.assertFalse(stale.set_boat((5, 0), 'H', 'acorazado'))
+        table = Table.objects.get(id=table.id)
+        self.assertEqual(table.version, 1)
+        self.assertEqual(list(table.boat_set.values_list('name',
+            flat=True)), ['portaaviones'])
+        self.assertEqual(Player.objects.get(id=self.player.id).ships_left,
+                1)
+
+    def test_stale_table_cells(self):
+        self.check_stale_table()
+
+    @override_settings(BATTLESHIP_BOARD_STORAGE='packed')
+    def test_stale_table_packed(self):
+        self.check_stale_table()
+
+    def test_malformed_boat(self):
+        table = Table.objects.create(player=self.player)
+        self.assertFalse(table.set_fleet([((0, 0), 'H')]))
+        self.assertFalse(table.set_fleet([((0, 0), 'H', 'bote')]))
+        self.assertFalse(table.boat_set.exists())
+
+
+class FleetSpecTest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.spec = FleetSpec.objects.create(name='corta')
+        ShipType.objects.create(spec=self.spec, name='lancha', letter='L',
+                size=2, amount=2)
+        ShipType.objects.create(spec=self.spec, name='balsa', letter='R',
+                size=1)
+
+    def test_spec_in_use_is_protected(self):
+        room = Room.objects.create(name='sala', map_size=6,
+                fleet_spec=self.spec)
+        with self.assertRaises(ProtectedError):
+            self.spec.delete()
+        self.assertTrue(Room.objects.filter(id=room.id).exists())
+
+    def create_player(self, room, name):
+        user = User.objects.create_user(name, password='clave')
+        player = Player.objects.create(user=user, room=room, name=name)
+        return player, Table.objects.create(player=player)
+
+    def test_quotas(self):
+        room = Room.objects.create(name='sala', map_size=6,
+                fleet_spec=self.spec)
+        player, table = self.create_player(room, 'jugador0')
+        self.assertEqual(table.get_boat_quotas(), {'lancha': 2, 'balsa': 1})
+        self.assertFalse(table.set_fleet([((0, 0), 'H', 'portaaviones')]))
+        self.assertFalse(table.set_fleet([((0, 0), 'H', 'lancha'),
+            ((2, 0), 'H', 'lancha'), ((4, 0), 'H', 'lancha')]))
+        self.assertTrue(table.set_fleet([((0, 0), 'H', 'lancha')]))
+        self.assertEqual(table.get_boat_quotas(), {'lancha': 1, 'balsa': 1})
+        # The boats of a spec can't touch either
+        self.assertFalse(table.set_fleet([((1, 1), 'V', 'lancha')]))
+        self.assertTrue(table.set_fleet([((2, 0), 'V', 'lancha'),
+            ((5, 5), 'H', 'balsa')]))
+        self.assertFalse(table.add_boat_available())
+        board = Table.objects.get(id=table.id).get_board()
+        self.assertEqual([board.get(0, 0), board.get(3, 0), board.get(5, 5)],
+                ['L', 'L', 'R'])
+        self.assertEqual(Player.objects.get(id=player.id).ships_left, 3)
+
+    def test_sink_custom_fleet(self):
+        room = Room.objects.create(name='sala', map_size=6,
+                fleet_spec=self.spec)
+        boats = [((0, 0), 'H', 'lancha'), ((2, 0), 'V', 'lancha'),
+                ((5, 5), 'H', 'balsa')]
+        players = []
+        for i in range(2):
+            player, table = self.create_player(room, 'jugador%d' % i)
+            self.assertTrue(table.set_fleet(boats))
+            player.set_ready(True)
+            players.append(player)
+        room.start_game()
+        shooter = Player.objects.get(room=room, turn=True)
+        victim = [p for p in players if p.id != shooter.id][0]
+        shooter.get_or_create_victim_table(victim.id)
+        self.assertEqual(room.attack_salvo([(0, 0), (0, 1)], shooter,
+            victim.id), ['T', 'T'])
+        self.assertEqual(Player.objects.get(id=victim.id).ships_left, 2)
+        self.assertEqual(sorted(room.get_afloat_sizes(victim.id)), [1, 2])
+        self.assertEqual(room.attack_salvo([(1, 1), (2, 0), (3, 0), (5, 5)],
+            shooter, victim.id), ['X', 'T', 'T', 'T'])
+        self.assertEqual(room.winner, shooter.id)
+        self.assertEqual(Room.objects.get(id=room.id).winner, shooter.id)
+
+    def test_ship_types_invalidate_rooms(self):
+        room = Room.objects.create(name='sala', map_size=6,
+                fleet_spec=self.spec)
+        player, table = self.create_player(room, 'jugador0')
+        self.assertEqual(table.get_boat_quotas(), {'lancha': 2, 'balsa': 1})
+        ShipType.objects.create(spec=self.spec, name='bote', letter='O',
+                size=3)
+        balsa = ShipType.objects.get(spec=self.spec, name='balsa')
+        balsa.amount = 2
+        balsa.save()
+        table = Table.objects.get(id=table.id)
+        self.assertEqual(table.get_boat_quotas(), {'lancha': 2, 'balsa': 2,
+            'bote': 1})
+        self.assertEqual(room.get_ruleset().sizes['bote'], 3)
+        balsa.delete()
+        self.assertNotIn('balsa', Table.objects.get(
+            id=table.id).get_boat_quotas())
+
+
+class BoardCacheTest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.room, (self.player,) = create_room(1)
+        self.table = Table.objects.get(player=self.player, victim=0)
+
+    def get_cached(self, namespace):
+        return cache.get_cache().get('battleship:%s:%d:%d' % (namespace,
+            self.table.id, self.table.version))
+
+    def test_versions_are_cached(self):
+        self.table.get_board()
+        render_board(self.table)
+        self.assertIsNotNone(self.get_cached('board'))
+        self.assertIsNotNone(self.get_cached('board-html'))
+
+    @override_settings(BATTLESHIP_BOARD_TTL=0)
+    def test_versions_expire(self):
+        cache.get_cache().clear()
+        self.table.get_board()
+        render_board(self.table)
+        self.assertIsNone(self.get_cached('board'))
+        self.assertIsNone(self.get_cached('board-html'))
+
+
+class LobbyTest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.user = User.objects.create_user('jugador0', password='clave')
+        self.rooms = {}
+        for name, size, start, winner in [('abierta', 10, False, 0),
+                ('en juego', 10, True, 0), ('terminada', 10, True, 1),
+                ('chica', 6, False, 0)]:
+            self.rooms[name] = Room.objects.create(name=name, map_size=size,
+                    start=start, winner=winner, admin=self.user.id).id
+
+    def names(self, rooms):
+        return [r['name'] for r in rooms]
+
+    def test_filters(self):
+        self.assertEqual(self.names(lobby.get_rooms()), ['chica',
+            'terminada', 'en juego', 'abierta'])
+        self.assertEqual(self.names(lobby.get_rooms('open')), ['chica',
+            'abierta'])
+        self.assertEqual(self.names(lobby.get_rooms('started')),
+                ['en juego'])
+        self.assertEqual(self.names(lobby.get_rooms('finished')),
+                ['terminada'])
+        self.assertEqual(self.names(lobby.get_rooms(map_size=6)), ['chica'])
+        self.assertEqual(self.names(lobby.get_rooms('open', 10)),
+                ['abierta'])
+        room = lobby.get_rooms(map_size=6)[0]
+        self.assertEqual((room['admin'], room['players']), (self.user.id, 0))
+
+    def test_before_cursor(self):
+        page = lobby.get_rooms(limit=3)
+        self.assertEqual(self.names(page), ['chica', 'terminada',
+            'en juego'])
+        page = lobby.get_rooms(before=page[-1]['id'], limit=3)
+        self.assertEqual(self.names(page), ['abierta'])
+        self.assertEqual(lobby.get_rooms(before=page[-1]['id']), [])
+        self.assertEqual(self.names(lobby.get_rooms('open',
+            before=self.rooms['chica'])), ['abierta'])
+
+    def test_generation_invalidates_pages(self):
+        self.assertEqual(lobby.get_rooms(map_size=6)[0]['players'], 0)
+        # An update without signals is not seen until the generation moves
+        Room.objects.filter(id=self.rooms['chica']).update(name='nueva')
+        self.assertEqual(self.names(lobby.get_rooms(map_size=6)), ['chica'])
+        generation = cache.generation('lobby')
+        Player.objects.create(user=self.user, room_id=self.rooms['chica'],
+                name='jugador0')
+        self.assertNotEqual(cache.generation('lobby'), generation)
+        room = lobby.get_rooms(map_size=6)[0]
+        self.assertEqual((room['name'], room['players']), ('nueva', 1))
+        room = Room.objects.get(id=self.rooms['abierta'])
+        room.start = True
+        room.save()
+        self.assertEqual(self.names(lobby.get_rooms('open')), ['nueva'])
+
+    @override_settings(BATTLESHIP_LOBBY_PAGE_SIZE=1)
+    def test_view(self):
+        self.client.login(username='jugador0', password='clave')
+        response = self.client.get(reverse('rooms-view'), {'status': 'open',
+            'size': '10'})
+        self.assertEqual(self.names(response.context['rooms']), ['abierta'])
+        self.assertEqual(response.context['before'], self.rooms['abierta'])
+        self.assertContains(response, 'creada por ti')
+        response = self.client.get(reverse('rooms-view'), {'status': 'x',
+            'size': 'y', 'before': self.rooms['en juego']})
+        self.assertIsNone(response.context['status'])
+        self.assertEqual(self.names(response.context['rooms']), ['abierta'])
+
+
+class IdentityMapTest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.room, self.players = create_room()
+
+    def in_request(self, func):
+        """ Return what func returns when it's called inside a request """
+        res = []
+        identity.IdentityMapMiddleware(lambda request: res.append(func()))(
+                None)
+        return res[0]
+
+    def test_instances_are_shared(self):
+        player = self.players[0]
+        table = Table.objects.get(player=player, victim=0)
+
+        def load():
+            t = identity.get(Table, id=table.id)
+            with self.assertNumQueries(0):
+                p = identity.get(Player, pk=str(player.id))
+                r = identity.get(Room, id=self.room.id)
+                self.assertIs(identity.get(Table, id=str(table.id)), t)
+            return t, p, r
+
+        t, p, r = self.in_request(load)
+        self.assertIs(t.player, p)
+        self.assertIs(p.room, r)
+        self.assertEqual(r.id, self.room.id)
+        # Outside a request every call loads a new instance
+        self.assertIsNot(identity.get(Room, id=self.room.id),
+                identity.get(Room, id=self.room.id))
+
+    def test_forget(self):
+        player = self.players[0]
+
+        def load():
+            p = identity.get(Player, id=player.id)
+            Player.objects.filter(id=player.id).update(name='otro')
+            self.assertIs(identity.get(Player, id=player.id), p)
+            identity.forget(Player)
+            return p, identity.get(Player, id=player.id)
+
+        before, after = self.in_request(load)
+        self.assertIsNot(before, after)
+        self.assertEqual((before.name, after.name), ('jugador0', 'otro'))
+
+    def test_get_or_404(self):
+        for value in ('0', 'sala'):
+            with self.assertRaises(Http404):
+                identity.get_or_404(Room, id=value)
+
+
+@override_settings(DEBUG=True, BATTLESHIP_QUERY_BUDGET_STRICT=True,
+        BATTLESHIP_EVENTS_TIMEOUT=0)
+class QueryBudgetTest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def view(self, queries, exempt=0):
+        @identity.query_budget(1)
+        def view(request):
+            for i in range(queries):
+                Room.objects.count()
+            with identity.budget_exempt():
+                for i in range(exempt):
+                    Room.objects.count()
+            return HttpResponse()
+        return view
+
+    def test_over_budget(self):
+        self.assertEqual(self.view(1, exempt=3)(None).status_code, 200)
+        with self.assertRaises(AssertionError):
+            self.view(2)(None)
+        with self.settings(BATTLESHIP_QUERY_BUDGET_STRICT=False):
+            with self.assertLogs('battleship.identity', 'WARNING'):
+                self.view(2)(None)
+
+    def test_game_views_within_budget(self):
+        room, (shooter, victim) = create_room()
+        self.client.login(username='jugador0', password='clave')
+        table = Table.objects.get(player=shooter, victim=0)
+        urls = [reverse('waiting-room-view', args=[room.id]),
+                reverse('my-table-view', args=[room.id, table.id])]
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.post(reverse('start-game-view', args=[room.id]))
+        room.refresh_from_db()
+        self.assertTrue(room.start)
+        if not room.is_turn_of(shooter):
+            room.end_shift(victim)
+        urls = [reverse('game-room-view', args=[room.id]),
+                reverse('select-victim-view', args=[room.id]),
+                reverse('victim-table-view', args=[room.id, victim.id]),
+                reverse('room-events-view', args=[room.id])]
+        self.assertEqual(self.client.get(reverse('attack-view',
+            args=[room.id])).status_code, 302)
+        self.client.post(urls[1], {'victim': victim.id})
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.post(urls[2], {'row': '0', 'column': '0'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Shot.objects.filter(room=room).exists())
+
+
+class SimulateCommandTest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def test_needs_games_and_players(self):
+        for option in ('--games', '--players'):
+            with self.assertRaisesMessage(CommandError, option):
+                call_command('simulate', option, '0', stdout=io.StringIO())
+        self.assertFalse(Room.objects.exists())
+
+    def test_plays_games(self):
+        out = io.StringIO()
+        call_command('simulate', '--games', '1', '--max-shots', '20',
+                stdout=out)
+        self.assertIn('end_shift', out.getvalue())
+        self.assertFalse(Room.objects.exists())
+
+
+class CreatePlayerTest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.room = Room.objects.create(name='sala', map_size=10)
+        self.room.set_admin(User.objects.create_user('admin',
+            password='clave'))
+        User.objects.create_user('invitado', password='clave')
+
+    def create_player(self, username):
+        self.client.login(username=username, password='clave')
+        url = reverse('create-player-view', args=[self.room.id])
+        self.assertEqual(self.client.post(url, {'name': username})
+                .status_code, 302)
+        return Player.objects.get(user__username=username, room=self.room)
+
+    def test_admin_player(self):
+        self.assertTrue(self.create_player('admin').admin)
+        self.assertFalse(self.create_player('invitado').admin)
+
+    def test_add_bot(self):
+        self.client.login(username='admin', password='clave')
+        url = reverse('add-bot-view', args=[self.room.id])
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.assertFalse(Player.objects.filter(room=self.room).exists())
+        self.client.post(url)
+        self.assertTrue(Player.objects.get(room=self.room).is_bot)
+
+
+def sink_fleet(room, shooter, victim):
+    """ Fires at every boat of the victim """
+    board = Table.objects.get(player=victim, victim=0).get_board()
+    n = board.size
+    cells = [(r, c) for r in range(n) for c in range(n)
+            if board.is_occupied(r, c)]
+    return room.attack_salvo(cells, shooter, victim.id)
+
+
+class RotateTurnTest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.room, self.players = create_room(3)
+        self.room.start_game()
+
+    def get_turns(self):
+        return list(Player.objects.filter(room=self.room,
+            turn=True).values_list('id', flat=True))
+
+    def test_rotation(self):
+        first, second, third = self.players
+        self.assertEqual(self.get_turns(), [first.id])
+        self.assertEqual(turns.rotate_turn(self.room, first.id), second.id)
+        self.assertEqual(turns.rotate_turn(self.room, second.id), third.id)
+        self.assertEqual(turns.rotate_turn(self.room, third.id), first.id)
+        self.assertEqual(self.get_turns(), [first.id])
+
+    def test_not_the_turn_of_the_player(self):
+        first, second, third = self.players
+        self.assertIsNone(turns.rotate_turn(self.room, second.id))
+        self.assertEqual(self.get_turns(), [first.id])
+        turns.rotate_turn(self.room, first.id)
+        # A second request of the same turn does not skip the next player
+        self.assertIsNone(turns.rotate_turn(self.room, first.id))
+        self.assertEqual(self.get_turns(), [second.id])
+
+    def test_skips_eliminated_players(self):
+        first, second, third = self.players
+        first.get_or_create_victim_table(second.id)
+        sink_fleet(self.room, first, second)
+        self.assertEqual(turns.rotate_turn(self.room, first.id), third.id)
+        self.assertEqual(turns.rotate_turn(self.room, third.id), first.id)
+        self.assertEqual(self.get_turns(), [first.id])
+
+
+class CountHitsTest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.room, self.players = create_room(3)
+        self.room.start_game()
+
+    def get_boats(self, player):
+        return dict(Boat.objects.filter(table__player=player,
+            table__victim=0).values_list('id', 'remaining'))
+
+    def test_sinking(self):
+        victim = self.players[1]
+        boats = self.get_boats(victim)
+        boat = min(boats, key=boats.get)
+        self.assertEqual(self.room.count_hits(victim.id, {boat: 1}),
+                ([], False))
+        self.assertEqual(self.get_boats(victim)[boat], boats[boat] - 1)
+        self.assertEqual(self.room.count_hits(victim.id,
+            {boat: boats[boat] - 1}), ([boat], False))
+        victim = Player.objects.get(id=victim.id)
+        self.assertEqual(victim.ships_left, len(boats) - 1)
+        self.assertTrue(victim.on_game)
+
+    def test_elimination_and_winner(self):
+        first, second, third = self.players
+        for victim in (second, third):
+            boats = self.get_boats(victim)
+            sunk, eliminated = self.room.count_hits(victim.id, boats)
+            self.assertEqual(sorted(sunk), sorted(boats))
+            self.assertTrue(eliminated)
+            victim = Player.objects.get(id=victim.id)
+            self.assertEqual((victim.ships_left, victim.on_game), (0, False))
+            if victim == second:
+                self.assertEqual(Room.objects.get(id=self.room.id).winner, 0)
+        self.assertEqual(self.room.winner, first.id)
+        self.assertEqual(Room.objects.get(id=self.room.id).winner, first.id)
+
+
+class VictimViewsTest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.room, self.players = create_room(3)
+        self.room.start_game()
+        shooter, sunk, other = self.players
+        shooter.get_or_create_victim_table(sunk.id)
+        sink_fleet(self.room, shooter, sunk)
+        self.client.login(username='jugador0', password='clave')
+
+    def test_select_victim_lists_players_on_game(self):
+        response = self.client.get(reverse('select-victim-view',
+            args=[self.room.id]))
+        victims = [int(v) for v, name in
+                response.context['form'].fields['victim'].choices]
+        self.assertEqual(victims, [self.players[2].id])
+
+    def test_attack_eliminated_player(self):
+        sunk = self.players[1]
+        url = reverse('victim-table-view', args=[self.room.id, sunk.id])
+        response = self.client.post(url, {'row': '9', 'column': '9'})
+        self.assertRedirects(response, reverse('select-victim-view',
+            args=[self.room.id]), fetch_redirect_response=False)
+        self.assertFalse(Shot.objects.filter(row=9, column=9).exists())
+
+    def test_victim_of_another_room(self):
+        room = Room.objects.create(name='otra', map_size=10)
+        stranger = Player.objects.create(user=self.players[1].user,
+                room=room, name='otro')
+        url = reverse('victim-table-view', args=[self.room.id, stranger.id])
+        response = self.client.post(url, {'row': '9', 'column': '9'})
+        self.assertEqual(response.status_code, 404)
+
+
+class AttackTest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.room, self.players = create_room(shots_per_turn=2)
+        self.room.start_game()
+        shooter, victim = self.players
+        shooter.get_or_create_victim_table(victim.id)
+        victim.get_or_create_victim_table(shooter.id)
+
+    def test_attack_out_of_turn(self):
+        shooter, victim = self.players
+        with self.assertRaises(turns.NotYourTurn):
+            self.room.attack_salvo([(0, 0)], victim, shooter.id)
+        self.assertFalse(Shot.objects.exists())
+        self.assertEqual(Room.objects.get(id=self.room.id).last_shot, 0)
+
+    def test_repeated_positions(self):
+        shooter, victim = self.players
+        with self.assertRaises(ValueError):
+            self.room.attack_salvo([(0, 0), (0, 0)], shooter, victim.id)
+        self.client.login(username='jugador0', password='clave')
+        url = reverse('victim-table-view', args=[self.room.id, victim.id])
+        response = self.client.post(url, {'row': '0', 'column': '0',
+            'row_2': '0', 'column_2': '0'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].non_field_errors())
+        response = self.client.post(reverse('api-room-attack-view',
+            args=[self.room.id]), json.dumps({'victim': victim.id,
+                'shots': [[0, 0], [0, 0]]}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Shot.objects.exists())
+
+
+class ReplayTest(TestCase):
+    """ The boards rebuilt at a sequence match the ones the game had """
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def play(self, turns=40):
+        """ Plays turns of the two players shooting each other and return
+        the room, the players, the tables and a dict sequence -> list of
+        the bytes of the boards of the tables after that shot
+        """
+        room, players = create_room()
+        room.start_game()
+        players[0].get_or_create_victim_table(players[1].id)
+        players[1].get_or_create_victim_table(players[0].id)
+        tables = list(Table.objects.filter(player__room=room).order_by('id'))
+        rng = random.Random(4)
+        targets = {}
+        for p in players:
+            targets[p.id] = [(r, c) for r in range(10) for c in range(10)]
+            rng.shuffle(targets[p.id])
+        boards = {0: self.boards(tables)}
+        for i in range(turns):
+            shooter, victim = players[i % 2], players[1 - i % 2]
+            room.attack_salvo([targets[shooter.id].pop()], shooter,
+                    victim.id)
+            boards[room.last_shot] = self.boards(tables)
+            if room.winner:
+                break
+            room.end_shift(shooter)
+        return room, players, tables, boards
+
+    def boards(self, tables):
+        return [Table.objects.get(id=t.id).get_board().to_bytes(boats=False)
+                for t in tables]
+
+    def check_replay(self, storage, interval):
+        with self.settings(BATTLESHIP_BOARD_STORAGE=storage,
+                BATTLESHIP_SNAPSHOT_INTERVAL=interval):
+            room, players, tables, boards = self.play()
+        self.assertEqual(len(boards), 41)
+        for t in tables:
+            self.assertEqual(t.packed is not None, storage == 'packed')
+        for sequence, expected in boards.items():
+            self.assertEqual([t.get_board_at(sequence).to_bytes(boats=False)
+                for t in tables], expected)
+        return tables
+
+    def test_replay_cells(self):
+        self.check_replay('cells', 0)
+        self.assertFalse(BoardSnapshot.objects.exists())
+
+    def test_replay_cells_snapshots(self):
+        tables = self.check_replay('cells', 3)
+        for t in tables:
+            self.assertTrue(BoardSnapshot.objects.filter(table=t).exists())
+
+    def test_replay_packed(self):
+        self.check_replay('packed', 0)
+        self.assertFalse(BoardSnapshot.objects.exists())
+
+    def test_replay_packed_snapshots(self):
+        tables = self.check_replay('packed', 3)
+        for t in tables:
+            self.assertTrue(BoardSnapshot.objects.filter(table=t).exists())
+
+    @override_settings(BATTLESHIP_BOARD_STORAGE='packed',
+            BATTLESHIP_SNAPSHOT_INTERVAL=2)
+    def test_packed_misses_keep_version(self):
+        room, (shooter, victim) = create_room()
+        room.start_game()
+        shooter.get_or_create_victim_table(victim.id)
+        own = Table.objects.get(player=victim, victim=0)
+        board = own.get_board()
+        boat = [(r, c) for r in range(10) for c in range(10)
+                if board.is_occupied(r, c)]
+        water = [(r, c) for r in range(10) for c in range(10)
+                if not board.is_occupied(r, c)]
+        self.assertEqual(room.attack_salvo(water[:3], shooter, victim.id),
+                ['X', 'X', 'X'])
+        self.assertEqual(Table.objects.get(id=own.id).version, own.version)
+        room.attack_salvo(boat[:1], shooter, victim.id)
+        room.attack_salvo(boat[1:2], shooter, victim.id)
+        # Only the hits move the version, the one that reaches an even
+        # version is snapshot
+        self.assertEqual(Table.objects.get(id=own.id).version,
+                own.version + 2)
+        sequence = 4 if own.version % 2 else 5
+        self.assertEqual(list(BoardSnapshot.objects.filter(
+            table=own).values_list('sequence', flat=True)), [sequence])
+
+    def test_fleet_board(self):
+        room, (shooter, victim) = create_room()
+        room.start_game()
+        shooter.get_or_create_victim_table(victim.id)
+        table = Table.objects.get(player=victim, victim=0)
+        board = table.get_board()
+        fleet = board.to_bytes()
+        cells = [(r, c) for r in range(10) for c in range(10)
+                if board.boat_at(r, c)]
+        room.attack_salvo(cells[:5] + [(9, 9)], shooter, victim.id)
+        table = Table.objects.get(id=table.id)
+        self.assertNotEqual(table.get_board().to_bytes(), fleet)
+        self.assertEqual(table.get_fleet_board().to_bytes(), fleet)
+
+    def test_replay_and_shots_api(self):
+        with self.settings(BATTLESHIP_SNAPSHOT_INTERVAL=3):
+            room, players, tables, boards = self.play(20)
+        self.client.login(username='jugador0', password='clave')
+        own = tables.index(Table.objects.get(player=players[0], victim=0))
+        url = reverse('api-table-replay-view',
+                args=[room.id, tables[own].id])
+        for at in (0, 7, 20):
+            data = self.client.get(url, {'at': at}).json()
+            self.assertEqual(data['sequence'], at)
+            board = Board.from_bytes(10, boards[at][own])
+            self.assertEqual(data['board'], board.encode())
+        self.assertEqual(self.client.get(url, {'at': 99}).json()['sequence'],
+                20)
+        url = reverse('api-room-shots-view', args=[room.id])
+        data = self.client.get(url, {'since': 10, 'limit': 5}).json()
+        self.assertEqual(data['last'], 20)
+        self.assertEqual([s['sequence'] for s in data['shots']],
+                [11, 12, 13, 14, 15])
+        self.assertEqual([(s['row'], s['column'], s['value'])
+            for s in data['shots']], list(Shot.objects.filter(room=room,
+                sequence__range=(11, 15)).values_list('row', 'column',
+                    'value')))
+        self.client.logout()
+        User.objects.create_user('mirón', password='clave')
+        self.client.login(username='mirón', password='clave')
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@override_settings(BATTLESHIP_ROOM_ACTORS=True,
+        BATTLESHIP_ACTOR_FLUSH_MOVES=1000,
+        BATTLESHIP_ACTOR_FLUSH_INTERVAL=60)
+class ActorAttackTest(TransactionTestCase):
+    """ The attacks of a started room go through its actor """
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.room, self.players = create_room()
+        self.room.start_game()
+        self.room.refresh_from_db()
+
+    def tearDown(self):
+        actors.stop()
+
+    def test_attack_form(self):
+        shooter, victim = self.players
+        shooter.get_or_create_victim_table(victim.id)
+        self.client.login(username='jugador0', password='clave')
+        url = reverse('victim-table-view', args=[self.room.id, victim.id])
+        response = self.client.post(url, {'row': '0', 'column': '0'})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        page = self.client.get(url)
+        self.assertContains(page, 'var boardVictim = %d;' % victim.id)
+        self.assertContains(page, 'var boardShooter = %d;' % shooter.id)
+        self.assertIsNotNone(actors.get_actor(self.room))
+        self.assertEqual(self.room.get_turn_player().id, victim.id)
+        actors.stop()
+        shot = Shot.objects.get(room=self.room)
+        self.assertEqual((shot.shooter_id, shot.victim_id, shot.row,
+            shot.column), (shooter.id, victim.id, 0, 0))
+        self.assertEqual(Room.objects.get(id=self.room.id).last_shot, 1)
+
+    def test_attack_salvo_same_as_database(self):
+        shooter, victim = self.players
+        own = Table.objects.get(player=victim, victim=0)
+        cells = [(r, c) for r in range(10) for c in range(10)
+                if own.get_board().is_occupied(r, c)]
+        values = self.room.attack_salvo(cells[:2] + [(9, 9)], shooter,
+                str(victim.id))
+        self.assertEqual(values[:2], ['T', 'T'])
+        actors.stop()
+        board = Table.objects.get(id=own.id).get_board()
+        self.assertEqual([board.get(r, c) for r, c in cells[:2]],
+                ['T', 'T'])
+
+    def test_attack_out_of_turn(self):
+        shooter, victim = self.players
+        victim.get_or_create_victim_table(shooter.id)
+        with self.assertRaises(turns.NotYourTurn):
+            self.room.attack_salvo([(0, 0)], victim, shooter.id)
+        self.assertIsNotNone(actors.get_actor(self.room))
+        actors.stop()
+        self.assertFalse(Shot.objects.exists())
+
+    def test_shots_api_before_flush(self):
+        shooter, victim = self.players
+        aux = shooter.get_or_create_victim_table(victim.id)
+        self.room.attack_salvo([(9, 9), (9, 8), (9, 7)], shooter, victim.id)
+        self.client.login(username='jugador0', password='clave')
+        data = self.client.get(reverse('api-room-shots-view',
+            args=[self.room.id])).json()
+        self.assertEqual(data['last'], 3)
+        self.assertEqual([s['sequence'] for s in data['shots']], [1, 2, 3])
+        data = self.client.get(reverse('api-table-replay-view',
+            args=[self.room.id, aux.id]), {'at': 2}).json()
+        self.assertEqual(data['sequence'], 2)
+        board = Board(10)
+        board.put(9, 9, 'X')
+        board.put(9, 8, 'X')
+        self.assertEqual(data['board'], board.encode())
+        self.assertIsNotNone(actors.get_actor(self.room))
+
+    def test_board_html_before_flush(self):
+        shooter, victim = self.players
+        aux = shooter.get_or_create_victim_table(victim.id)
+        render_board(Table.objects.get(id=aux.id))
+        self.room.attack_salvo([(9, 9)], shooter, victim.id)
+        table = Table.objects.get(id=aux.id)
+        self.assertEqual(table.version, aux.version)
+        self.assertEqual(table.get_version(), aux.version + 1)
+        self.assertIn('>X<', render_board(table))
+
+
+class StubWorker(object):
+    """ WSGI server in a thread that answers with its url and records the
+    method, path and router secret of every request
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.server = router.ThreadingWSGIServer(('127.0.0.1', 0),
+                router.QuietHandler)
+        self.server.set_app(self.app)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        threading.Thread(target=self.server.serve_forever,
+                daemon=True).start()
+
+    def app(self, environ, start_response):
+        self.requests.append((environ['REQUEST_METHOD'],
+            environ['PATH_INFO'], environ.get('HTTP_X_BATTLESHIP_ROUTER')))
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [self.url.encode()]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class DroppingWorker(StubWorker):
+    """ Worker that reads the request and closes the connection without
+    answering, like a worker that dies while running the request
+    """
+
+    def __init__(self):
+        requests = self.requests = []
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                requests.append(self.rfile.readline())
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0),
+                Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever,
+                daemon=True).start()
+
+
+def refused_url():
+    """ Return the url of a local port that nobody listens """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return 'http://127.0.0.1:%d' % port
+
+
+class RouterTest(SimpleTestCase):
+
+    def setUp(self):
+        self.workers = [StubWorker() for i in range(3)]
+        self.urls = [w.url for w in self.workers]
+
+    def tearDown(self):
+        for worker in self.workers:
+            worker.close()
+
+    def request(self, app, path, method='GET'):
+        """ Calls the router. Return (status, headers, body) """
+        environ = {'PATH_INFO': path, 'REQUEST_METHOD': method}
+        setup_testing_defaults(environ)
+        response = []
+
+        def start_response(status, headers):
+            response.extend([status, dict(headers)])
+        body = b''.join(app(environ, start_response))
+        return response[0], response[1], body
+
+    def room_owned_by(self, app, worker, rooms=range(1, 100)):
+        """ Return the first room whose owner is worker """
+        return next(r for r in rooms if max(app.workers,
+            key=lambda w: router.score(r, w)) == worker)
+
+    def test_room_of(self):
+        self.assertEqual(router.room_of('/room-12/'), 12)
+        self.assertEqual(router.room_of('/api/v1/room-3/shots'), 3)
+        self.assertIsNone(router.room_of('/lobby/'))
+
+    def test_rooms_are_sticky(self):
+        app = router.Router(self.urls)
+        owners = {}
+        for room in range(1, 30):
+            status, headers, body = self.request(app, '/room-%d/' % room)
+            self.assertEqual(status, '200 OK')
+            owners[room] = body.decode()
+            self.assertEqual(headers['X-Battleship-Worker'], owners[room])
+        self.assertEqual(len(set(owners.values())), 3)
+        for room in range(1, 30):
+            body = self.request(app, '/api/v1/room-%d/shots' % room)[2]
+            self.assertEqual(body.decode(), owners[room])
+        # Only the rooms of a worker that goes down move
+        app.set_alive(self.urls[0], False)
+        for room in range(1, 30):
+            body = self.request(app, '/room-%d/' % room)[2].decode()
+            if owners[room] == self.urls[0]:
+                self.assertNotEqual(body, self.urls[0])
+            else:
+                self.assertEqual(body, owners[room])
+
+    def test_failover_on_refused_connection(self):
+        down = refused_url()
+        app = router.Router([down] + self.urls)
+        room = self.room_owned_by(app, down)
+        status, headers, body = self.request(app, '/room-%d/' % room)
+        self.assertEqual(status, '200 OK')
+        self.assertIn(body.decode(), self.urls)
+        self.assertNotIn(down, app.alive)
+        self.assertFalse(app.is_healthy(down))
+        # No worker left
+        app = router.Router([down])
+        self.assertTrue(self.request(app, '/room-1/')[0].startswith('503'))
+
+    def test_release_on_handoff(self):
+        app = router.Router(self.urls, secret='secreto')
+        owner = self.workers[0]
+        room = self.room_owned_by(app, owner.url)
+        app.set_alive(owner.url, False)
+        other = self.request(app, '/room-%d/' % room)[2].decode()
+        self.assertNotEqual(other, owner.url)
+        app.set_alive(owner.url, True)
+        self.assertEqual(self.request(app, '/room-%d/' % room)[2].decode(),
+                owner.url)
+        worker = self.workers[self.urls.index(other)]
+        self.assertIn(('POST', '/internal/room-%d/release' % room,
+            'secreto'), worker.requests)
+        self.assertFalse(any(path.startswith('/internal/')
+            for method, path, secret in owner.requests))
+
+    def test_dropped_request_is_not_retried(self):
+        dropping = DroppingWorker()
+        self.workers.append(dropping)
+        app = router.Router([dropping.url] + self.urls)
+        room = self.room_owned_by(app, dropping.url)
+        status, headers, body = self.request(app, '/room-%d/' % room,
+                'POST')
+        self.assertTrue(status.startswith('502'))
+        self.assertEqual(len(dropping.requests), 1)
+        self.assertFalse(any(w.requests for w in self.workers[:3]))
+        self.assertNotIn(dropping.url, app.alive)
+
+
+@override_settings(BATTLESHIP_ROOM_ACTORS=True,
+        BATTLESHIP_ACTOR_FLUSH_MOVES=1000,
+        BATTLESHIP_ACTOR_FLUSH_INTERVAL=60,
+        BATTLESHIP_EVENTS_TIMEOUT=10)
+class ASGIHandlerTest(TransactionTestCase):
+    """ The views run in a pool of one thread, so a request that held it
+    would block the rest
+    """
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.room, self.players = create_room()
+        self.client.login(username='jugador0', password='clave')
+        self.cookie = ('sessionid=%s' %
+                self.client.cookies['sessionid'].value).encode()
+        self.handler = asgi.ASGIHandler(get_wsgi_application(), threads=1)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        actors.stop()
+        self.loop.close()
+        self.handler.executor.shutdown()
+
+    async def get(self, path, query=''):
+        """ Sends a GET through the handler. Return (status, body) """
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request'}
+
+        async def send(message):
+            sent.append(message)
+
+        await self.handler({'type': 'http', 'method': 'GET', 'path': path,
+            'query_string': query.encode(),
+            'headers': [(b'host', b'testserver'), (b'cookie', self.cookie)]},
+            receive, send)
+        return sent[0]['status'], sent[1]['body']
+
+    def test_publish_wakes_polls(self):
+        broker = events.get_broker()
+        channel = events.room_channel(self.room.id)
+        since = events.last_event(self.room.id)
+
+        async def scenario():
+            polls = [asyncio.ensure_future(self.get('/room-%d/events' %
+                self.room.id, 'since=%d' % since)) for i in range(3)]
+            for i in range(500):
+                if len(broker._waiters.get(channel, ())) == 3:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(len(broker._waiters[channel]), 3)
+            # The waiting polls leave the thread to the other requests
+            status, body = await asyncio.wait_for(self.get('/health'), 5)
+            self.assertEqual(status, 200)
+            self.assertFalse(any(poll.done() for poll in polls))
+            publisher = threading.Thread(target=broker.publish,
+                    args=(channel, {'type': 'turn', 'player': 1}))
+            publisher.start()
+            publisher.join()
+            return await asyncio.wait_for(asyncio.gather(*polls), 5)
+
+        for status, body in self.loop.run_until_complete(scenario()):
+            self.assertEqual(status, 200)
+            data = json.loads(body.decode())
+            self.assertEqual(data['last'], since + 1)
+            self.assertEqual(data['events'], [{'type': 'turn',
+                'player': 1}])
+        self.assertNotIn(channel, broker._waiters)
+
+    def test_lifespan_shutdown_flushes_actors(self):
+        shooter, victim = self.players
+        self.room.start_game()
+        self.room.refresh_from_db()
+        self.room.attack_salvo([(0, 0)], shooter, victim.id)
+        self.assertIsNotNone(actors.get_actor(self.room))
+        self.assertFalse(Shot.objects.exists())
+        received = [{'type': 'lifespan.startup'},
+                {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return received.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        self.loop.run_until_complete(self.handler({'type': 'lifespan'},
+            receive, send))
+        self.assertEqual(sent, ['lifespan.startup.complete',
+            'lifespan.shutdown.complete'])
+        self.assertNotIn(self.room.id, actors._actors)
+        self.assertEqual(list(Shot.objects.values_list('shooter', 'row',
+            'column')), [(shooter.id, 0, 0)])
@@ -0,0 +1,69 @@
+from django.db import transaction
+from django.db.models import BooleanField, Case, IntegerField, Value, When
+
+from . import cache, identity
+
+
+class NotYourTurn(ValueError):
+    """ The player attacked when it was not its turn """
+
+
+def lock_room(room):
+    """ Lock the row of the room until the end of the transaction """
+    type(room).objects.select_for_update().filter(id=room.id).exists()
+
+
+def assign_turns(room):
+    """ Gives the turn numbers of every player of the room in one update and
+    the turn to the first one. Return the id of the first player or None if
+    the game had already started
+    """
+    with transaction.atomic():
+        lock_room(room)
+        started = type(room).objects.filter(id=room.id,
+                start=False).update(start=True)
+        if not started:
+            return None
+        room.start = True
+        players = room.player_set.all()
+        ids = list(players.order_by('id').values_list('id', flat=True))
+        first = ids[0]
+        is_first = Case(When(id=first, then=Value(True)),
+                default=Value(False), output_field=BooleanField())
+        players.update(
+                number_turn=Case(*[When(id=p, then=Value(n))
+                    for n, p in enumerate(ids, 1)],
+                    output_field=IntegerField()),
+                on_game=True, turn=is_first, offensive=is_first,
+                defense=is_first)
+    identity.forget(players.model)
+    cache.bump('lobby')
+    return first
+
+
+def rotate_turn(room, player=None):
+    """ Gives the turn to the next player on game. If player (an id) is
+    given the turn only changes if it's still the turn of that player, so
+    two concurrent requests can not skip a player. Return the id of the
+    next player or None if the turn did not change
+    """
+    with transaction.atomic():
+        lock_room(room)
+        players = room.player_set.filter(on_game=True)
+        order = list(players.order_by('number_turn').values_list('id',
+            'number_turn', 'turn'))
+        current = [(p, n) for p, n, turn in order if turn]
+        if not current or (player is not None and current[0][0] != player):
+            return None
+        current, number = current[0]
+        following = [p for p, n, turn in order if n > number] or \
+                [p for p, n, turn in order]
+        next_player = following[0]
+        ended = players.filter(id=current, turn=True).update(turn=False,
+                offensive=False, defense=False)
+        if not ended:
+            return None
+        players.filter(id=next_player).update(turn=True, offensive=True,
+                defense=True)
+    identity.forget(players.model)
+    return next_player
@@ -1,5 +1,5 @@
 from django.conf.urls import url
-from . import views
+from . import views, api, metrics
 
 urlpatterns = [
     url(r'^signup/$', views.signup, name='signup-view'),
@@ -16,6 +16,10 @@ urlpatterns = [
         name='attack-view'),
     url(r'^room-(?P<room>[0-9]+)/gameroom/selectvictim$',
         views.select_victim, name='select-victim-view'),
+    url(r'^room-(?P<room>[0-9]+)/events$', views.room_events,
+        name='room-events-view'),
+    url(r'^room-(?P<room>[0-9]+)/addbot$', views.add_bot,
+        name='add-bot-view'),
     url(r'^room-(?P<room>[0-9]+)/startgame$', views.start_game,
         name='start-game-view'),
     url(r'^room-(?P<room>[0-9]+)/victim-table-(?P<victim>[0-9]+)$',
@@ -26,4 +30,23 @@ urlpatterns = [
         name='my-table-view'),
     url(r'^room-(?P<room>[0-9]+)/table-(?P<table>[0-9]+)/setboats$',
         views.set_boats, name='set-boats-view'),
+    url(r'^room-(?P<room>[0-9]+)/table-(?P<table>[0-9]+)/autoplace$',
+        views.auto_place, name='auto-place-view'),
+    url(r'^api/v1/room-(?P<room>[0-9]+)/table-(?P<table>[0-9]+)$',
+        api.table_view, name='api-table-view'),
+    url(r'^api/v1/room-(?P<room>[0-9]+)/table-(?P<table>[0-9]+)/changes$',
+        api.table_changes, name='api-table-changes-view'),
+    url(r'^api/v1/room-(?P<room>[0-9]+)/table-(?P<table>[0-9]+)/replay$',
+        api.table_replay, name='api-table-replay-view'),
+    url(r'^api/v1/room-(?P<room>[0-9]+)/table-(?P<table>[0-9]+)/placements$',
+        api.table_placements, name='api-table-placements-view'),
+    url(r'^api/v1/room-(?P<room>[0-9]+)/shots$', api.room_shots,
+        name='api-room-shots-view'),
+    url(r'^api/v1/room-(?P<room>[0-9]+)/attack$', api.room_attack,
+        name='api-room-attack-view'),
+    url(r'^api/v1/cache-stats$', api.cache_stats, name='api-cache-stats-view'),
+    url(r'^health$', api.health, name='health-view'),
+    url(r'^internal/room-(?P<room>[0-9]+)/release$', api.release_room,
+        name='release-room-view'),
+    url(r'^metrics$', metrics.metrics_view, name='metrics-view'),
 ]
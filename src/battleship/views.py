@@ -6,10 +6,13 @@ from django.contrib.auth import (
     )
 from django.urls import reverse
 from django.contrib import messages
-from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponseRedirect
+from django.shortcuts import render
+from django.http import Http404, HttpResponseRedirect, JsonResponse
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import require_POST
 
+from . import ai, events, identity, lobby, turns
 from .models import Room, Table, Player
 from .forms import (
         CreateRoomForm, CreatePlayerForm, SetBoatsForm, SelectVictimForm,
@@ -74,12 +77,26 @@ def create_room(request):
 
 @login_required
 def join_room(request):
-    rooms = Room.objects.all()
-    return render(request, 'room_list.html', {'rooms':rooms})
+    status = request.GET.get('status')
+    if status not in lobby.STATUS:
+        status = None
+    try:
+        map_size = int(request.GET['size'])
+    except (KeyError, ValueError):
+        map_size = None
+    try:
+        before = int(request.GET['before'])
+    except (KeyError, ValueError):
+        before = None
+    rooms = lobby.get_rooms(status, map_size, before)
+    ctx = {'rooms': rooms, 'status': status, 'size': map_size}
+    if len(rooms) == getattr(settings, 'BATTLESHIP_LOBBY_PAGE_SIZE', 20):
+        ctx['before'] = rooms[-1]['id']
+    return render(request, 'room_list.html', ctx)
 
 @login_required
 def create_player(request, room):
-    r = get_object_or_404(Room, id=room)
+    r = identity.get_or_404(Room, id=room)
     try:
         Player.objects.get(user=request.user, room=room)
         messages.error(request, "Ya te encuentras en esta sala")
@@ -95,40 +112,41 @@ def create_player(request, room):
         player = form.save(commit=False)
         player.user = request.user
         player.room = r
+        player.admin = u is not None and u == request.user
         player.save()
-        if u is not None and u == request.user:
-            player.set_admin(True)
         table = Table.objects.create(player=player)
         return HttpResponseRedirect(table.get_absolute_url() + '/setboats')
     return render(request, 'create_player.html', {'form':form, 'room':r})
 
 @login_required
+@identity.query_budget(4)
 def waiting_room(request, room):
-    r = get_object_or_404(Room, id=room)
+    r = identity.get_or_404(Room, id=room)
     if r.start and r.get_player_from_user(request.user) is not None:
         return HttpResponseRedirect(reverse('game-room-view', args=[room]))
     u = r.get_admin()
     players = Player.objects.filter(room=r)
-    ctx = {'players':players, 'room':r, 'admin':u}
+    ctx = {'players':players, 'room':r, 'admin':u,
+            'last_event': events.last_event(r.id)}
     return render(request, 'waiting_room.html', ctx)
 
 @login_required
+@identity.query_budget(4)
 def my_table(request, room, table):
-    r = get_object_or_404(Room, id=room)
-    t = get_object_or_404(Table, id=table)
-    mytable = t.get_table(enumerated=True)
+    r = identity.get_or_404(Room, id=room)
+    t = identity.get_or_404(Table, id=table)
     ctx = dict()
     ctx['room'] = r
-    ctx['table'] = mytable
+    ctx['table'] = t
     ctx['table_obj'] = t.id
-    ctx['coordinate'] = ctx['table'][0]
     return render(request, 'my_table.html', ctx)
 
 @login_required
+@identity.query_budget(16)
 def set_boats(request, room, table):
-    r = get_object_or_404(Room, id=room)
-    t = get_object_or_404(Table, id=table)
-    player = get_object_or_404(Player, user=request.user, room=r)
+    r = identity.get_or_404(Room, id=room)
+    t = identity.get_or_404(Table, id=table)
+    player = identity.get_or_404(Player, user=request.user, room=r)
     if player.is_ready():
         return HttpResponseRedirect(r.get_absolute_url())
     form = SetBoatsForm(t, request.POST or None)
@@ -137,8 +155,7 @@ def set_boats(request, room, table):
         row = int(form.cleaned_data['row'])
         orientation = form.cleaned_data['orientation']
         boat_type = form.cleaned_data['boat_type']
-        if t.position_is_valid((row, col), orientation, boat_type):
-            t.set_boat((row, col), orientation, boat_type)
+        if t.set_boat((row, col), orientation, boat_type):
             if not t.add_boat_available():
                 player.set_ready(True)
                 return HttpResponseRedirect(r.get_absolute_url())
@@ -149,13 +166,43 @@ def set_boats(request, room, table):
     ctx = dict()
     ctx['form'] = form
     ctx['room'] = r
-    ctx['table'] = t.get_table(enumerated=True)
-    ctx['coordinate'] = ctx['table'][0]
+    ctx['table'] = t
     return render(request, 'set_boat.html', ctx)
 
 @login_required
+@require_POST
+def auto_place(request, room, table):
+    """
+    Puts the boats that the player did not place yet in random legal
+    positions
+    """
+    r = identity.get_or_404(Room, id=room)
+    player = identity.get_or_404(Player, user=request.user, room=r)
+    t = identity.get_or_404(Table, id=table, player=player, victim=0)
+    if player.is_ready():
+        return HttpResponseRedirect(r.get_absolute_url())
+    if ai.place_fleet(t) and not t.add_boat_available():
+        player.set_ready(True)
+        return HttpResponseRedirect(r.get_absolute_url())
+    messages.error(request, 'No hay lugar para el resto de la flota')
+    return HttpResponseRedirect(reverse('set-boats-view', args=[room, table]))
+
+@login_required
+@require_POST
+def add_bot(request, room):
+    r = identity.get_or_404(Room, id=room)
+    if r.get_admin() != request.user:
+        messages.error(request, "Solo el administrador puede agregar jugadores")
+    elif r.start:
+        messages.error(request, "La sala ya esta en juego")
+    elif ai.add_bot(r) is None:
+        messages.error(request, "La flota no entra en el mapa")
+    return HttpResponseRedirect(r.get_absolute_url())
+
+@login_required
+@identity.query_budget(9)
 def start_game(request, room):
-    r = get_object_or_404(Room, id=room)
+    r = identity.get_or_404(Room, id=room)
     is_ready, msg = r.check_state()
     if not is_ready:
         messages.error(request, msg)
@@ -164,8 +211,9 @@ def start_game(request, room):
     return HttpResponseRedirect(r.get_absolute_url())
 
 @login_required
+@identity.query_budget(5)
 def game_room(request, room):
-    r = get_object_or_404(Room, id=room)
+    r = identity.get_or_404(Room, id=room)
     t = r.get_table_from_user(request.user)
     if t is None:
         messages.error(request, "No tienes un jugador en esta sala.")
@@ -173,18 +221,23 @@ def game_room(request, room):
     if not r.start:
         messages.error(request, "No esta lista aun la sala")
         return HttpResponseRedirect(r.get_absolute_url())
-    table_player = t.get_table(enumerated=True)
-    player_turn = Player.objects.get(room=r, turn=True)
-    ctx = {'room': r, 'table': table_player,
-            'coordinate': table_player[0], 'player': t.player,
-            'player_turn': player_turn}
+    player_turn = r.get_turn_player()
+    winner = player_turn if player_turn is not None and \
+            r.winner == player_turn.id else None
+    ctx = {'room': r, 'table': t, 'player': t.player,
+            'player_turn': player_turn, 'winner': winner,
+            'on_game': r.is_on_game(t.player),
+            'last_event': events.last_event(r.id)}
     return render(request, 'game_room.html', ctx)
 
 @login_required
+@identity.query_budget(3)
 def attack(request, room):
-    r = get_object_or_404(Room, id=room)
-    p = Player.objects.get(user=request.user, room=r)
-    if p.turn:
+    r = identity.get_or_404(Room, id=room)
+    p = identity.get(Player, user=request.user, room=r)
+    if r.winner:
+        messages.error(request, "El juego termino")
+    elif r.is_turn_of(p):
         return HttpResponseRedirect(reverse('select-victim-view',
             args=[room]))
     else:
@@ -192,10 +245,14 @@ def attack(request, room):
     return HttpResponseRedirect(reverse('game-room-view', args=[room]))
 
 @login_required
+@identity.query_budget(9)
 def select_victim(request, room):
-    r = get_object_or_404(Room, id=room)
+    r = identity.get_or_404(Room, id=room)
     p = r.get_player_from_user(request.user)
-    players = Player.objects.filter(room=r).exclude(id=p.id)
+    if p is None:
+        raise Http404
+    players = Player.objects.filter(id__in=r.get_players_on_game()).exclude(
+            id=p.id).order_by('number_turn')
     form = SelectVictimForm(players, request.POST or None)
     if form.is_valid():
         victim = int(form.cleaned_data['victim'])
@@ -205,15 +262,59 @@ def select_victim(request, room):
     return render(request, 'select_victim.html', {'form':form})
 
 @login_required
+@identity.query_budget(33)
 def victim_table(request, room, victim):
-    r = get_object_or_404(Room, id=room)
+    r = identity.get_or_404(Room, id=room)
     p = r.get_player_from_user(request.user)
-    victim_table = Table.objects.get(player=p, victim=victim)
+    victim = identity.get_or_404(Player, id=victim, room=r).id
+    if p is None or victim == p.id:
+        raise Http404
     form = AttackForm(r, request.POST or None)
     if form.is_valid():
-        row = int(form.cleaned_data['row'])
-        col = int(form.cleaned_data['column'])
-        r.attack((row, col), p, victim)
-    t = victim_table.get_table(enumerated=True)
+        if not r.is_turn_of(p):
+            messages.error(request, "Aun no es tu turno")
+            return HttpResponseRedirect(reverse('game-room-view',
+                args=[room]))
+        if victim not in r.get_players_on_game():
+            messages.error(request, "Ese jugador ya no esta en juego")
+            return HttpResponseRedirect(reverse('select-victim-view',
+                args=[room]))
+        try:
+            r.attack_salvo(form.get_positions(), p, victim)
+        except turns.NotYourTurn:
+            messages.error(request, "Aun no es tu turno")
+            return HttpResponseRedirect(reverse('game-room-view',
+                args=[room]))
+        if r.winner:
+            return HttpResponseRedirect(reverse('game-room-view',
+                args=[room]))
+        r.end_shift(p)
+        # Reloading the page must not fire the shots again
+        return HttpResponseRedirect(reverse('victim-table-view',
+            args=[room, victim]))
+    t = identity.get(Table, player=p, victim=victim)
     return render(request, 'victim_table.html', {'form':form,
-        'table': t, 'coordinate': t[0]})
+        'table': t, 'room': r, 'player': p, 'victim': victim,
+        'last_event': events.last_event(r.id)})
+
+@login_required
+@identity.query_budget(2)
+def room_events(request, room):
+    """
+    Long poll of the events of a room. Waits until there are events after
+    the sequence number given in the since parameter
+    """
+    r = identity.get_or_404(Room, id=room)
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        since = 0
+    timeout = getattr(settings, 'BATTLESHIP_EVENTS_TIMEOUT', 25)
+    if not request.META.get('battleship.events_wait', True):
+        # The ASGI handler waits for the events without holding the thread
+        timeout = 0
+    channel = events.room_channel(r.id)
+    new_events = events.get_broker().wait(channel, since, timeout)
+    last = new_events[-1][0] if new_events else since
+    return JsonResponse({'last': last,
+        'events': [event for seq, event in new_events]})
@@ -0,0 +1,18 @@
+"""
+ASGI config for src project.
+
+It exposes the ASGI callable as a module-level variable named
+``application``, e.g. ``uvicorn config.asgi:application``. The views run in
+a bounded thread pool and the long poll of the room events is awaited
+without holding a thread, see battleship.asgi.
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+from battleship.asgi import ASGIHandler  # noqa: E402
+
+application = ASGIHandler(get_wsgi_application())
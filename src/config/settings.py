@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'battleship.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,6 +49,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'battleship.identity.IdentityMapMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -76,13 +78,101 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/1.10/ref/settings/#databases
 
-DATABASES = {
+# BATTLESHIP_DB_ENGINE selects sqlite3 (default) or postgresql. The
+# connections are kept open BATTLESHIP_DB_CONN_MAX_AGE seconds; put a pooler
+# like pgbouncer in front of PostgreSQL for more workers than connections.
+# The databases created before the migrations of battleship are brought up to
+# date with manage.py migrate --fake-initial.
+
+DB_ENGINE = os.environ.get('BATTLESHIP_DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('BATTLESHIP_DB_NAME', 'battleship'),
+            'USER': os.environ.get('BATTLESHIP_DB_USER', ''),
+            'PASSWORD': os.environ.get('BATTLESHIP_DB_PASSWORD', ''),
+            'HOST': os.environ.get('BATTLESHIP_DB_HOST', ''),
+            'PORT': os.environ.get('BATTLESHIP_DB_PORT', ''),
+            'CONN_MAX_AGE': int(os.environ.get('BATTLESHIP_DB_CONN_MAX_AGE',
+                60)),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('BATTLESHIP_DB_NAME',
+                os.path.join(BASE_DIR, 'db.sqlite3')),
+            'CONN_MAX_AGE': int(os.environ.get('BATTLESHIP_DB_CONN_MAX_AGE',
+                60)),
+            'OPTIONS': {'timeout': 20},
+        }
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'BACKEND': os.environ.get('BATTLESHIP_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('BATTLESHIP_CACHE_LOCATION', 'battleship'),
     }
 }
 
+BATTLESHIP_CACHE = 'default'
+
+# The boards, their html and their placement masks are cached by table
+# version; the old versions expire after BATTLESHIP_BOARD_TTL seconds.
+
+BATTLESHIP_BOARD_TTL = 600
+
+
+# Storage of the new boards: 'cells' keeps a Cell row per boat segment and
+# shot, 'packed' keeps the whole board in a binary column of the table.
+# manage.py packboards moves the existing boards to the packed column.
+
+BATTLESHIP_BOARD_STORAGE = os.environ.get('BATTLESHIP_BOARD_STORAGE', 'cells')
+
+# Every shot is logged in Shot; a table saves a snapshot of its board every
+# BATTLESHIP_SNAPSHOT_INTERVAL versions to rebuild past boards quickly.
+
+BATTLESHIP_SNAPSHOT_INTERVAL = 20
+
+# With BATTLESHIP_ROOM_ACTORS=1 every started room is played in memory by a
+# single writer thread of the process, which writes the changes every
+# BATTLESHIP_ACTOR_FLUSH_MOVES moves or BATTLESHIP_ACTOR_FLUSH_INTERVAL
+# seconds. The moves after the last write are lost if the process dies, and
+# all the requests of a room must reach the same process.
+
+BATTLESHIP_ROOM_ACTORS = os.environ.get('BATTLESHIP_ROOM_ACTORS') == '1'
+
+BATTLESHIP_ACTOR_FLUSH_MOVES = 20
+
+BATTLESHIP_ACTOR_FLUSH_INTERVAL = 0.5
+
+# Secret shared with the router (manage.py runrouter), which forwards every
+# room to one worker and asks the previous worker to release the rooms that
+# move. Without it the workers refuse the release requests.
+
+BATTLESHIP_ROUTER_SECRET = os.environ.get('BATTLESHIP_ROUTER_SECRET')
+
+# Threads of the ASGI entry point (config/asgi.py) that run the views. The
+# players waiting in the long poll of the events do not take one.
+
+BATTLESHIP_ASGI_THREADS = 16
+
+
+# Metrics of the requests, served in the Prometheus format at /metrics.
+# The workers that share BATTLESHIP_METRICS_DIR are aggregated.
+
+BATTLESHIP_METRICS = os.environ.get('BATTLESHIP_METRICS') == '1'
+
+BATTLESHIP_METRICS_DIR = os.environ.get('BATTLESHIP_METRICS_DIR')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators